@@ -4,6 +4,7 @@ Active Director с PRE-FILTER, override gating и circuit breaker
 + Unified Task Run Logging (task_run.jsonl)
 """
 
+import asyncio
 import json
 import logging
 import os
@@ -434,6 +435,15 @@ class ActiveDirector:
             
             return consilium_result
     
+    async def run_active_analysis_async(self, consilium_result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Асинхронная обёртка над run_active_analysis
+        
+        Синхронный вызов Director (HTTP к OpenAI) выполняется в пуле потоков,
+        поэтому несколько задач могут ждать ответа одновременно.
+        """
+        return await asyncio.to_thread(self.run_active_analysis, consilium_result)
+    
     def _pre_director_filter(self, consilium_result: Dict[str, Any]) -> Tuple[bool, List[str]]:
         """
         PRE-DIRECTOR FILTER (cheap gate)
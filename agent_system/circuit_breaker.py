@@ -1,3 +1,4 @@
+import threading
 import time
 from typing import Any, Dict, Optional
 
@@ -19,6 +20,8 @@ class CircuitBreaker:
         self.total_failures = 0
         self.total_blocked = 0
         self.state_changes = []
+        # Один брейкер на всех потоках DirectorAdapter
+        self._lock = threading.Lock()
 
     def _record_state_change(self, old_state: str, new_state: str, reason: str) -> None:
         self.state_changes.append({"timestamp": time.time(), "from": old_state, "to": new_state, "reason": reason})
@@ -26,54 +29,57 @@ class CircuitBreaker:
             self.state_changes.pop(0)
 
     def can_execute(self) -> bool:
-        if self.state == "CLOSED":
-            return True
-
-        if self.state == "OPEN":
-            if self.last_failure_time and time.time() - self.last_failure_time >= self.recovery_timeout:
-                old_state = self.state
-                self.state = "HALF_OPEN"
-                self.success_count = 0
-                self._record_state_change(old_state, "HALF_OPEN", "Recovery timeout elapsed")
+        with self._lock:
+            if self.state == "CLOSED":
                 return True
-            self.total_blocked += 1
-            return False
 
-        if self.state == "HALF_OPEN":
-            return True
+            if self.state == "OPEN":
+                if self.last_failure_time and time.time() - self.last_failure_time >= self.recovery_timeout:
+                    old_state = self.state
+                    self.state = "HALF_OPEN"
+                    self.success_count = 0
+                    self._record_state_change(old_state, "HALF_OPEN", "Recovery timeout elapsed")
+                    return True
+                self.total_blocked += 1
+                return False
+
+            if self.state == "HALF_OPEN":
+                return True
 
-        return False
+            return False
 
     def record_success(self) -> None:
-        self.total_calls += 1
-
-        if self.state == "HALF_OPEN":
-            self.success_count += 1
-            if self.success_count >= self.success_threshold:
-                old_state = self.state
-                self.state = "CLOSED"
+        with self._lock:
+            self.total_calls += 1
+
+            if self.state == "HALF_OPEN":
+                self.success_count += 1
+                if self.success_count >= self.success_threshold:
+                    old_state = self.state
+                    self.state = "CLOSED"
+                    self.failure_count = 0
+                    self._record_state_change(old_state, "CLOSED", f"{self.success_count} successful calls")
+            elif self.state == "CLOSED":
                 self.failure_count = 0
-                self._record_state_change(old_state, "CLOSED", f"{self.success_count} successful calls")
-        elif self.state == "CLOSED":
-            self.failure_count = 0
 
     def record_failure(self, error: Exception = None) -> None:
-        self.total_calls += 1
-        self.total_failures += 1
-        self.failure_count += 1
-        self.last_failure_time = time.time()
-
-        if self.state == "HALF_OPEN":
-            old_state = self.state
-            self.state = "OPEN"
-            self._record_state_change(old_state, "OPEN", f"Failure in HALF_OPEN: {error}")
-        elif self.state == "CLOSED":
-            if self.failure_count >= self.failure_threshold:
+        with self._lock:
+            self.total_calls += 1
+            self.total_failures += 1
+            self.failure_count += 1
+            self.last_failure_time = time.time()
+
+            if self.state == "HALF_OPEN":
                 old_state = self.state
                 self.state = "OPEN"
-                self._record_state_change(
-                    old_state, "OPEN", f"Failure threshold reached ({self.failure_count}/{self.failure_threshold})"
-                )
+                self._record_state_change(old_state, "OPEN", f"Failure in HALF_OPEN: {error}")
+            elif self.state == "CLOSED":
+                if self.failure_count >= self.failure_threshold:
+                    old_state = self.state
+                    self.state = "OPEN"
+                    self._record_state_change(
+                        old_state, "OPEN", f"Failure threshold reached ({self.failure_count}/{self.failure_threshold})"
+                    )
 
     def get_status(self) -> Dict[str, Any]:
         time_until_retry = None
@@ -9,14 +9,16 @@ import os
 import re
 import subprocess
 import sys
+import threading
 import time
 from dataclasses import dataclass
 from enum import Enum
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
+import httpx
 import openai
-from openai import OpenAI
+from openai import DefaultHttpxClient, OpenAI
 
 from agent_system.circuit_breaker import CircuitBreaker
 from agent_system.decision_log import append_decision_event
@@ -74,6 +76,36 @@ def _get_director_circuit_breaker() -> CircuitBreaker:
     return _director_circuit_breaker
 
 
+# Верхняя граница одновременных вызовов Director (AIMD в run_production_50)
+DIRECTOR_MAX_CONNECTIONS = 20
+
+_director_clients: Dict[Tuple[str, Optional[str]], OpenAI] = {}
+
+
+def _get_director_client(api_key: str, base_url: Optional[str]) -> OpenAI:
+    """Общий OpenAI-клиент на (api_key, base_url)
+    
+    Все DirectorAdapter процесса (ActiveDirector, ShadowDirector, consilium)
+    делят один пул keep-alive соединений и не повторяют TCP/TLS handshake.
+    """
+    key = (api_key, base_url)
+    client = _director_clients.get(key)
+    if client is None:
+        client_kwargs = {
+            "api_key": api_key,
+            "http_client": DefaultHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=DIRECTOR_MAX_CONNECTIONS,
+                    max_keepalive_connections=DIRECTOR_MAX_CONNECTIONS
+                )
+            )
+        }
+        if base_url:
+            client_kwargs["base_url"] = base_url
+        client = _director_clients[key] = OpenAI(**client_kwargs)
+    return client
+
+
 class DirectorAdapter:
     """Адаптер для работы с OpenAI Director"""
     
@@ -84,10 +116,7 @@ class DirectorAdapter:
         self.enabled = bool(self.api_key) and not self.allow_fallback
         self.client = None
         if self.enabled:
-            client_kwargs = {"api_key": self.api_key}
-            if self.base_url:
-                client_kwargs["base_url"] = self.base_url
-            self.client = OpenAI(**client_kwargs)
+            self.client = _get_director_client(self.api_key, self.base_url)
         self.model = os.getenv("DIRECTOR_MODEL", "gpt-5.2")
         self.metrics = {
             'calls_today': 0,
@@ -95,6 +124,8 @@ class DirectorAdapter:
             'total_cost': 0.0,
             'last_reset': time.strftime('%Y-%m-%d')
         }
+        # Адаптер общий для потоков ActiveDirector: счётчики меняются под блокировкой
+        self._metrics_lock = threading.Lock()
         
         # Жёсткие триггеры для Director
         self.hard_triggers = {
@@ -278,11 +309,12 @@ Focus on:
         
         # Обновляем метрики
         today = time.strftime('%Y-%m-%d')
-        if self.metrics['last_reset'] != today:
-            self.metrics['calls_today'] = 0
-            self.metrics['last_reset'] = today
-        
-        self.metrics['calls_today'] += 1
+        with self._metrics_lock:
+            if self.metrics['last_reset'] != today:
+                self.metrics['calls_today'] = 0
+                self.metrics['last_reset'] = today
+            
+            self.metrics['calls_today'] += 1
         
         # Создаём промпт
         prompt = self.create_director_prompt(request)
@@ -339,10 +371,10 @@ Focus on:
             
             # Обновляем метрики
             usage = response.usage
-            self.metrics['total_tokens'] += usage.total_tokens
-            
             cost = (usage.prompt_tokens * 0.00015 + usage.completion_tokens * 0.0006) / 1000
-            self.metrics['total_cost'] += cost
+            with self._metrics_lock:
+                self.metrics['total_tokens'] += usage.total_tokens
+                self.metrics['total_cost'] += cost
             
             # Парсим ответ
             result = json.loads(response.choices[0].message.content)
@@ -416,16 +448,19 @@ Focus on:
     
     def get_metrics(self) -> Dict[str, Any]:
         """Получить метрики использования"""
+        with self._metrics_lock:
+            metrics = dict(self.metrics)
         return {
-            **self.metrics,
-            'cost_per_call': self.metrics['total_cost'] / max(1, self.metrics['calls_today']),
-            'avg_tokens_per_call': self.metrics['total_tokens'] / max(1, self.metrics['calls_today'])
+            **metrics,
+            'cost_per_call': metrics['total_cost'] / max(1, metrics['calls_today']),
+            'avg_tokens_per_call': metrics['total_tokens'] / max(1, metrics['calls_today'])
         }
     
     def reset_daily_metrics(self):
         """Сброс дневных метрик"""
-        self.metrics['calls_today'] = 0
-        self.metrics['last_reset'] = time.strftime('%Y-%m-%d')
+        with self._metrics_lock:
+            self.metrics['calls_today'] = 0
+            self.metrics['last_reset'] = time.strftime('%Y-%m-%d')
 
 
 # Пример использования
@@ -6,6 +6,7 @@ Director Circuit Breaker - авто-rollback по метрикам для защ
 import json
 import logging
 import os
+import threading
 from collections import deque
 from dataclasses import dataclass
 from datetime import datetime, timedelta
@@ -42,6 +43,9 @@ class DirectorCircuitBreaker:
     
     def __init__(self):
         self.metrics_history: deque = deque(maxlen=100)  # Последние 100 вызовов
+        # Вызовы Director идут из пула потоков (run_active_analysis_async):
+        # запись метрик, проверка и смена режима выполняются под одной блокировкой
+        self._lock = threading.RLock()
         self.log_file = "director_circuit_breaker.jsonl"
         self.current_mode = self._get_current_mode()
         
@@ -79,8 +83,9 @@ class DirectorCircuitBreaker:
     
     def _set_director_mode(self, new_mode: str, reason: str):
         """Устанавливает новый режим Director"""
-        old_mode = self.current_mode
-        self.current_mode = new_mode
+        with self._lock:
+            old_mode = self.current_mode
+            self.current_mode = new_mode
         
         # Логируем переключение
         event = {
@@ -115,10 +120,11 @@ class DirectorCircuitBreaker:
             confidence_diff=confidence_diff
         )
         
-        self.metrics_history.append(metrics)
-        
-        # Проверяем нужен ли rollback
-        self._check_circuit_breaker()
+        with self._lock:
+            self.metrics_history.append(metrics)
+            
+            # Проверяем нужен ли rollback
+            self._check_circuit_breaker()
     
     def _check_circuit_breaker(self):
         """Проверяет условия для circuit breaker"""
@@ -175,8 +181,10 @@ class DirectorCircuitBreaker:
         """Вычисляет rolling метрики за последние 20 вызовов и день"""
         
         now = datetime.now()
-        last_20 = list(self.metrics_history)[-20:]  # Последние 20
-        last_day = [m for m in self.metrics_history if now - m.timestamp <= timedelta(days=1)]
+        with self._lock:
+            history = list(self.metrics_history)
+        last_20 = history[-20:]  # Последние 20
+        last_day = [m for m in history if now - m.timestamp <= timedelta(days=1)]
         
         # Метрики за последние 20 вызовов
         override_count_20 = sum(1 for m in last_20 if m.override_applied)
@@ -199,15 +207,16 @@ class DirectorCircuitBreaker:
     def get_current_status(self) -> Dict[str, Any]:
         """Возвращает текущий статус circuit breaker"""
         
-        rolling_metrics = self._calculate_rolling_metrics() if self.metrics_history else {}
-        
-        return {
-            "current_mode": self.current_mode,
-            "total_calls": len(self.metrics_history),
-            "rolling_metrics": rolling_metrics,
-            "limits": self.limits,
-            "health": "healthy" if self.current_mode == "active" else "degraded"
-        }
+        with self._lock:
+            rolling_metrics = self._calculate_rolling_metrics() if self.metrics_history else {}
+            
+            return {
+                "current_mode": self.current_mode,
+                "total_calls": len(self.metrics_history),
+                "rolling_metrics": rolling_metrics,
+                "limits": self.limits,
+                "health": "healthy" if self.current_mode == "active" else "degraded"
+            }
     
     def _log_event(self, event: Dict[str, Any]):
         """Логирует событие circuit breaker"""
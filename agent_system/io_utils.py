@@ -0,0 +1,36 @@
+"""
+Запись JSON-отчётов на диск
+"""
+import json
+import os
+from pathlib import Path
+from typing import Any, Union
+
+try:
+    import orjson
+
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+def dumps_json(obj: Any) -> bytes:
+    """Сериализует объект в UTF-8 JSON с отступом 2 (orjson, если установлен)"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(
+            obj,
+            option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+        )
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+
+
+def write_json(path: Union[str, Path], obj: Any) -> None:
+    """Атомарно записывает JSON: временный файл рядом с целевым + os.replace.
+
+    Читатель отчёта никогда не увидит его наполовину записанным.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_bytes(dumps_json(obj))
+    os.replace(tmp_path, path)
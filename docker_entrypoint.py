@@ -6,36 +6,79 @@ Docker entrypoint для агентской системы
 import os
 import sys
 import time
+import queue
 import signal
+import socket
+import selectors
 import subprocess
 import threading
 from pathlib import Path
 
+# Максимальное число буферов в одном вызове os.writev
+IOV_MAX = os.sysconf("SC_IOV_MAX") if hasattr(os, "sysconf") else 1024
+
+# Окно накопления строк лога перед записью (секунды)
+LOG_BATCH_WINDOW = 0.1
+# fdatasync после каждой пачки — для развёртываний, где нужна надёжность логов
+LOG_FSYNC_STRICT = os.getenv("LOG_FSYNC_STRICT", "false").lower() == "true"
+
 class ServiceManager:
     """Менеджер сервисов для Docker контейнера"""
 
     def __init__(self):
         self.services = {}
         self.running = True
-
-    def start_service(self, name: str, command: list, cwd: str = None):
-        """Запуск сервиса"""
+        # pidfd каждого дочернего процесса становится читаемым при его завершении
+        self._selector = selectors.DefaultSelector()
+        # Обработчик SIGCHLD пишет байт в этот пайп и будит основной цикл
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+        self._sigchld_installed = self._install_sigchld_handler()
+        # Лог-файлы открываются один раз на сервис; потоки мониторинга кладут
+        # строки в очередь, единственный поток-писатель пишет их пачками
+        self._log_files = {}
+        self._log_lock = threading.Lock()
+        self._log_queue = queue.SimpleQueue()
+        self._log_writer = threading.Thread(target=self._log_writer_loop, daemon=True)
+        self._log_writer.start()
+        # (секунда, b"YYYY-mm-dd HH:MM:SS ") — префикс пересчитывается раз в секунду
+        self._ts_cache = (0, b"")
+
+    def start_service(self, name: str, command: list, cwd: str = None, log_to_console: bool = True):
+        """Запуск сервиса.
+
+        При ``log_to_console=False`` вывод сервиса пишется ядром прямо в его
+        лог-файл, без пайпа и потока мониторинга.
+        """
         print(f"🚀 Starting {name}...")
 
         try:
+            if name not in self._log_files:
+                self._log_files[name] = open(f"/app/logs/{name}.log", "ab", buffering=0)
+            logfile = self._log_files[name]
+
             process = subprocess.Popen(
                 command,
                 cwd=cwd or "/app",
-                stdout=subprocess.PIPE,
+                stdout=subprocess.PIPE if log_to_console else logfile,
                 stderr=subprocess.STDOUT,
-                universal_newlines=True,
-                bufsize=1,
             )
 
-            self.services[name] = {"process": process, "command": command, "start_time": time.time()}
+            self.services[name] = {
+                "process": process,
+                "command": command,
+                "log_to_console": log_to_console,
+                "start_time": time.time(),
+            }
+            self._watch_exit(name, process)
 
-            # Запускаем мониторинг вывода в отдельном потоке
-            threading.Thread(target=self._monitor_service_output, args=(name, process), daemon=True).start()
+            if log_to_console:
+                # Запускаем мониторинг вывода в отдельном потоке
+                threading.Thread(
+                    target=self._monitor_service_output, args=(name, process, logfile), daemon=True
+                ).start()
 
             print(f"✅ {name} started with PID {process.pid}")
             return True
@@ -44,25 +87,162 @@ class ServiceManager:
             print(f"❌ Failed to start {name}: {e}")
             return False
 
-    def _monitor_service_output(self, name: str, process):
+    def _monitor_service_output(self, name: str, process, logfile):
         """Мониторинг вывода сервиса"""
+        fd = process.stdout.fileno()
+        pending = b""
         try:
-            for line in iter(process.stdout.readline, ""):
-                if line.strip():
-                    print(f"[{name}] {line.strip()}")
-                    # Логируем в файл
-                    with open(f"/app/logs/{name}.log", "a") as f:
-                        f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {line}")
+            # os.read отдаёт всё, что накопилось в пайпе (до 64 KiB), поэтому
+            # пачка строк от сервиса уходит в лог одним writev
+            while True:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    break
+                *lines, pending = (pending + chunk).split(b"\n")
+                self._write_log_lines(name, logfile, lines)
+            if pending:
+                self._write_log_lines(name, logfile, [pending])
         except Exception as e:
             print(f"❌ Error monitoring {name}: {e}")
             with open(f"/app/logs/{name}_error.log", "a") as f:
                 f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} Monitor error: {e}\n")
 
+    def _write_log_lines(self, name: str, logfile, lines: list):
+        """Вывод строк в консоль и передача их потоку записи логов"""
+        ts = self._timestamp_prefix()
+        bufs = []
+        for line in lines:
+            line = line.rstrip(b"\r")
+            if not line.strip():
+                continue
+            # Декодируем только для вывода в консоль, в лог идут исходные байты
+            print(f"[{name}] {line.strip().decode('utf-8', 'replace')}")
+            bufs.append(ts + line + b"\n")
+
+        if bufs:
+            self._log_queue.put((logfile, bufs))
+
+    def _log_writer_loop(self):
+        """Поток записи логов: копит строки LOG_BATCH_WINDOW и пишет по файлам"""
+        while True:
+            item = self._log_queue.get()
+            if item is None:
+                return
+
+            batch = {}
+            deadline = time.monotonic() + LOG_BATCH_WINDOW
+            while item is not None:
+                logfile, bufs = item
+                batch.setdefault(logfile, []).extend(bufs)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._log_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            self._write_log_batch(batch)
+            if item is None:
+                return
+
+    def _write_log_batch(self, batch: dict):
+        """Запись накопленных строк: один writev (и fdatasync) на файл"""
+        with self._log_lock:
+            for logfile, bufs in batch.items():
+                if logfile.closed:
+                    continue
+                try:
+                    fd = logfile.fileno()
+                    for start in range(0, len(bufs), IOV_MAX):
+                        os.writev(fd, bufs[start : start + IOV_MAX])
+                    if LOG_FSYNC_STRICT:
+                        os.fdatasync(fd)
+                except OSError as e:
+                    print(f"❌ Error writing log {logfile.name}: {e}")
+
+    def _timestamp_prefix(self) -> bytes:
+        """Префикс времени для строк лога, кэшированный в пределах секунды"""
+        now = int(time.time())
+        second, prefix = self._ts_cache
+        if now != second:
+            prefix = time.strftime("%Y-%m-%d %H:%M:%S ", time.localtime(now)).encode()
+            self._ts_cache = (now, prefix)
+        return prefix
+
+    def _close_logs(self):
+        """Дозапись очереди и закрытие лог-файлов"""
+        self._log_queue.put(None)
+        self._log_writer.join(timeout=5)
+        with self._log_lock:
+            for logfile in self._log_files.values():
+                logfile.close()
+            self._log_files.clear()
+
+    def _install_sigchld_handler(self) -> bool:
+        """Установка обработчика SIGCHLD (POSIX, только из главного потока)"""
+        if not hasattr(signal, "SIGCHLD"):
+            return False
+        try:
+            signal.signal(signal.SIGCHLD, self._on_child_exit)
+        except ValueError:
+            return False
+        return True
+
+    def _on_child_exit(self, signum, frame):
+        """SIGCHLD: будим основной цикл, сам статус забирает check_services"""
+        try:
+            os.write(self._wakeup_w, b"\0")
+        except BlockingIOError:
+            # Пайп уже полон — цикл и так проснётся
+            pass
+
+    def _drain_wakeup(self):
+        """Очистка пайпа пробуждения после select"""
+        try:
+            while os.read(self._wakeup_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _watch_exit(self, name: str, process):
+        """Регистрация pidfd процесса в селекторе (Linux >= 5.3)"""
+        try:
+            pidfd = os.pidfd_open(process.pid)
+        except (AttributeError, OSError):
+            # Старое ядро или не Linux — остаётся периодический опрос
+            return
+        self._selector.register(pidfd, selectors.EVENT_READ, name)
+        self.services[name]["pidfd"] = pidfd
+
+    def _unwatch_exit(self, name: str):
+        """Снятие pidfd завершившегося процесса с селектора"""
+        pidfd = self.services.get(name, {}).pop("pidfd", None)
+        if pidfd is not None:
+            self._selector.unregister(pidfd)
+            os.close(pidfd)
+
+    def wait_for_exit(self, poll_interval: float = 10):
+        """Ожидание завершения любого из сервисов.
+
+        Если установлен обработчик SIGCHLD или у всех сервисов есть pidfd,
+        блокируется без таймаута до первого события; иначе просыпается каждые
+        ``poll_interval`` секунд.
+        """
+        watched = self._sigchld_installed or all("pidfd" in service for service in self.services.values())
+        if not self.services or not watched:
+            time.sleep(poll_interval)
+            return
+        for key, _ in self._selector.select(timeout=None):
+            if key.fd == self._wakeup_r:
+                self._drain_wakeup()
+
     def check_services(self):
         """Проверка состояния сервисов"""
         for name, service in self.services.items():
             process = service["process"]
             if process.poll() is not None:
+                self._unwatch_exit(name)
                 print(f"⚠️  Service {name} stopped with code {process.returncode}")
                 # Логируем ошибку
                 with open(f"/app/logs/{name}_crash.log", "a") as f:
@@ -89,9 +269,10 @@ class ServiceManager:
                 service["process"].wait(timeout=10)
             except:
                 service["process"].kill()
+            self._unwatch_exit(name)
 
             # Запускаем новый
-            self.start_service(name, service["command"])
+            self.start_service(name, service["command"], log_to_console=service["log_to_console"])
 
     def stop_all_services(self):
         """Остановка всех сервисов"""
@@ -113,6 +294,10 @@ class ServiceManager:
             except Exception as e:
                 print(f"❌ Error stopping {name}: {e}")
 
+            self._unwatch_exit(name)
+
+        self._close_logs()
+
 def setup_environment():
     """Настройка окружения"""
     print("🔧 Setting up environment...")
@@ -148,17 +333,22 @@ def wait_for_postgres():
 
     import psycopg2
 
+    postgres_port = int(os.getenv("POSTGRES_PORT", 5432))
     max_attempts = 30
 
     for attempt in range(max_attempts):
         try:
+            # Дешёвая проверка, что порт слушается; полное подключение с
+            # авторизацией делаем только после неё
+            with socket.create_connection((postgres_host, postgres_port), timeout=2):
+                pass
             conn = psycopg2.connect(
                 host=postgres_host,
-                port=os.getenv("POSTGRES_PORT", 5432),
+                port=postgres_port,
                 database=os.getenv("POSTGRES_DB", "agent_memory"),
                 user=os.getenv("POSTGRES_USER", "agent_user"),
                 password=os.getenv("POSTGRES_PASSWORD", "agent_password"),
-                connect_timeout=5,
+                connect_timeout=3,
             )
             conn.close()
             print("✅ PostgreSQL is ready!")
@@ -170,6 +360,23 @@ def wait_for_postgres():
             else:
                 print(f"❌ PostgreSQL not available after {max_attempts} attempts")
 
+def wait_for_ports(ports: list, timeout: float = 120, interval: float = 0.05) -> bool:
+    """Ожидание, пока локальные порты начнут принимать TCP-соединения"""
+    deadline = time.monotonic() + timeout
+    pending = list(ports)
+
+    while pending:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.settimeout(0.1)
+            if sock.connect_ex(("127.0.0.1", pending[0])) == 0:
+                pending.pop(0)
+                continue
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(interval)
+
+    return True
+
 def main():
     """Главная функция"""
     print("🤖 Agent System Docker Container Starting...")
@@ -193,24 +400,39 @@ def main():
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
 
-    # Запускаем сервисы
+    # Запускаем сервисы; log_to_console=False — вывод только в /app/logs/<name>.log
     services_to_start = [
-        {"name": "tool_server", "command": ["python", "-m", "agent_system.tool_server", "--port", "8011"], "delay": 0},
-        {"name": "llm_server", "command": ["python", (os.getenv("LLM_SERVER_IMPL") or "serve_enhanced.py"), "--port", "8010"], "delay": 3},
+        {
+            "name": "tool_server",
+            "command": ["python", "-m", "agent_system.tool_server", "--port", "8011"],
+            "wait_for_ports": [],
+            "log_to_console": False,
+        },
+        {
+            "name": "llm_server",
+            "command": ["python", (os.getenv("LLM_SERVER_IMPL") or "serve_enhanced.py"), "--port", "8010"],
+            "wait_for_ports": [],
+            "log_to_console": False,
+        },
         {
             "name": "ui_server",
             "command": ["python", "ui.py", "--server_port", "7864", "--server_name", "0.0.0.0"],
-            "delay": 6,
+            # UI стартует, когда tool_server и llm_server начали принимать соединения
+            "wait_for_ports": [8011, 8010],
+            "log_to_console": True,
         },
     ]
 
-    # Запускаем сервисы с задержками
+    # Сервисы без зависимостей стартуют сразу, остальные — по готовности портов
     for service_config in services_to_start:
-        if service_config["delay"] > 0:
-            print(f"⏳ Waiting {service_config['delay']}s before starting {service_config['name']}...")
-            time.sleep(service_config["delay"])
+        if service_config["wait_for_ports"]:
+            print(f"⏳ Waiting for ports {service_config['wait_for_ports']} before starting {service_config['name']}...")
+            if not wait_for_ports(service_config["wait_for_ports"]):
+                print(f"⚠️  Ports not ready, starting {service_config['name']} anyway")
 
-        success = manager.start_service(service_config["name"], service_config["command"])
+        success = manager.start_service(
+            service_config["name"], service_config["command"], log_to_console=service_config["log_to_console"]
+        )
 
         if not success:
             print(f"❌ Failed to start {service_config['name']}")
@@ -226,7 +448,7 @@ def main():
     # Основной цикл мониторинга
     try:
         while manager.running:
-            time.sleep(10)
+            manager.wait_for_exit()
             manager.check_services()
     except KeyboardInterrupt:
         print("\n🛑 Shutting down...")
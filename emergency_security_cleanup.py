@@ -3,11 +3,15 @@
 ЭКСТРЕННАЯ ОЧИСТКА БЕЗОПАСНОСТИ
 Немедленное исправление критических уязвимостей безопасности
 """
+import ast
+import mmap
 import os
 import re
 import shutil
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
-from typing import List, Dict, Set
+from typing import Iterator, List, Dict, Optional, Set, Tuple
 import logging
 
 # Настройка логирования
@@ -17,59 +21,134 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Шаблоны hardcoded секретов по категориям
+SECRET_PATTERNS = {
+    'api_keys': [
+        r'sk-[a-zA-Z0-9]{48}',  # OpenAI keys
+        r'["\'][a-zA-Z0-9]{32,}["\']',  # Generic long keys
+        r'api_key.*=.*["\'][a-zA-Z0-9_-]{20,}["\']',  # API key assignments
+    ],
+    'passwords': [
+        r'password.*=.*["\'][^"\']{8,}["\']',
+        r'passwd.*=.*["\'][^"\']{8,}["\']',
+    ],
+    'tokens': [
+        r'token.*=.*["\'][a-zA-Z0-9_-]{20,}["\']',
+        r'access_token.*=.*["\'][a-zA-Z0-9_-]{20,}["\']',
+    ]
+}
+
+# Каталоги, в которые сканер не спускается
+IGNORED_DIRS = frozenset({
+    '.git', '.venv', 'venv', 'node_modules', '__pycache__', 'site-packages', 'build', 'dist',
+})
+
+def _iter_py_files(root: str) -> Iterator[str]:
+    """Обход дерева через os.scandir с отсечением служебных каталогов"""
+    stack = [root]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in IGNORED_DIRS:
+                        stack.append(entry.path)
+                elif entry.name.endswith('.py') and not entry.name.startswith('.'):
+                    yield entry.path
+
+# Заголовок класса: имя в группе 1
+_CLASS_RE = re.compile(r"^\s*class\s+([A-Za-z_][A-Za-z_0-9]*)")
+
+# Импорт os в начале строки (import os / from os import ...)
+_IMPORT_OS_RE = re.compile(r"^\s*(?:import os\b|from os import)", re.MULTILINE)
+
+def _contains_any(data, literals: Tuple[bytes, ...]) -> bool:
+    """Есть ли в данных (bytes или mmap) хотя бы один из литералов
+    
+    Литералов единицы, а find работает прямо по mmap без копирования файла.
+    """
+    return any(data.find(literal) != -1 for literal in literals)
+
+def _scan_one(
+    py_file: str, secret_re: "re.Pattern[bytes]", categories: List[str], compromised_keys: Tuple[bytes, ...]
+) -> Tuple[str, Dict[str, List[str]], bool, Optional[str]]:
+    """Сканирует один файл; вынесено на уровень модуля для ProcessPoolExecutor.
+
+    Файл отображается в память и сканируется байтовым regex без чтения в str.
+    """
+    found: Dict[str, List[str]] = {}
+    try:
+        fd = os.open(py_file, os.O_RDONLY)
+    except OSError as e:
+        return py_file, found, False, str(e)
+    
+    try:
+        if os.fstat(fd).st_size == 0:
+            return py_file, found, False, None
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+            for match in secret_re.finditer(mm):
+                category = categories[match.lastindex - 1]
+                secret = match.group().decode('utf-8', 'replace')
+                found.setdefault(category, []).append(f"{os.path.normpath(py_file)}:{secret}")
+            
+            # Проверка на конкретные скомпрометированные ключи
+            has_key = _contains_any(mm, compromised_keys)
+    except (OSError, ValueError) as e:
+        return py_file, found, False, str(e)
+    finally:
+        os.close(fd)
+    
+    return py_file, found, has_key, None
+
 class EmergencySecurityCleanup:
     """Экстренная очистка критических проблем безопасности"""
     
     def __init__(self):
         self.project_root = Path(".")
         self.compromised_key = os.getenv("AGENT_API_KEY", "")
+        self.compromised_keys: Tuple[bytes, ...] = tuple(k.encode() for k in (self.compromised_key,) if k)
         self.files_with_keys: List[Path] = []
+        # Ключ в одинарных или двойных кавычках (кавычки должны совпадать)
+        self._key_re = re.compile(r"([\"'])" + re.escape(self.compromised_key) + r"\1")
+        
+        # Все шаблоны объединены в одну альтернацию: содержимое файла
+        # проходится один раз, категория определяется по номеру группы
+        alternatives = []
+        self._secret_categories: List[str] = []
+        for category, pattern_list in SECRET_PATTERNS.items():
+            for pattern in pattern_list:
+                alternatives.append(f"(?P<g{len(alternatives)}>{pattern})")
+                self._secret_categories.append(category)
+        self._secret_re = re.compile("|".join(alternatives).encode(), re.IGNORECASE)
         
     def scan_for_hardcoded_secrets(self) -> Dict[str, List[str]]:
         """Сканирует все файлы на наличие hardcoded секретов"""
         logger.info("🔍 Сканирование hardcoded секретов...")
         
-        patterns = {
-            'api_keys': [
-                r'sk-[a-zA-Z0-9]{48}',  # OpenAI keys
-                r'["\'][a-zA-Z0-9]{32,}["\']',  # Generic long keys
-                r'api_key.*=.*["\'][a-zA-Z0-9_-]{20,}["\']',  # API key assignments
-            ],
-            'passwords': [
-                r'password.*=.*["\'][^"\']{8,}["\']',
-                r'passwd.*=.*["\'][^"\']{8,}["\']',
-            ],
-            'tokens': [
-                r'token.*=.*["\'][a-zA-Z0-9_-]{20,}["\']',
-                r'access_token.*=.*["\'][a-zA-Z0-9_-]{20,}["\']',
-            ]
-        }
-        
         found_secrets = {}
+        py_files = _iter_py_files(str(self.project_root))
         
-        for py_file in self.project_root.rglob("*.py"):
-            if py_file.name.startswith('.'):
-                continue
-                
-            try:
-                content = py_file.read_text(encoding='utf-8')
-                
-                for category, pattern_list in patterns.items():
-                    for pattern in pattern_list:
-                        matches = re.findall(pattern, content, re.IGNORECASE)
-                        if matches:
-                            if category not in found_secrets:
-                                found_secrets[category] = []
-                            found_secrets[category].extend([
-                                f"{py_file}:{match}" for match in matches
-                            ])
-                            
-                # Проверка на конкретный скомпрометированный ключ
-                if self.compromised_key in content:
-                    self.files_with_keys.append(py_file)
-                    
-            except Exception as e:
-                logger.warning(f"Не удалось прочитать {py_file}: {e}")
+        # Файлы независимы — раздаём их по процессам
+        with ProcessPoolExecutor() as executor:
+            results = executor.map(
+                _scan_one,
+                py_files,
+                repeat(self._secret_re),
+                repeat(self._secret_categories),
+                repeat(self.compromised_keys),
+                chunksize=32,
+            )
+            for py_file, found, has_key, error in results:
+                if error is not None:
+                    logger.warning(f"Не удалось прочитать {py_file}: {error}")
+                    continue
+                for category, matches in found.items():
+                    found_secrets.setdefault(category, []).extend(matches)
+                if has_key:
+                    self.files_with_keys.append(Path(py_file))
                 
         return found_secrets
     
@@ -83,18 +162,17 @@ class EmergencySecurityCleanup:
             try:
                 content = file_path.read_text(encoding='utf-8')
                 
-                # Заменяем скомпрометированный ключ на переменную окружения
-                old_pattern = f'"{self.compromised_key}"'
-                new_pattern = 'os.getenv("AGENT_API_KEY", "")'
-                
-                content = content.replace(old_pattern, new_pattern)
-                content = content.replace(f"'{self.compromised_key}'", new_pattern)
+                # Заменяем скомпрометированный ключ в любых кавычках за один проход
+                new_content = self._key_re.sub('os.getenv("AGENT_API_KEY", "")', content)
+                if new_content == content:
+                    logger.info(f"ℹ️ {file_path} не содержит ключа в кавычках, пропуск")
+                    continue
                 
                 # Добавляем импорт os если его нет
-                if 'import os' not in content and 'from os import' not in content:
-                    content = 'import os\n' + content
+                if not _IMPORT_OS_RE.search(new_content):
+                    new_content = 'import os\n' + new_content
                 
-                file_path.write_text(content, encoding='utf-8')
+                file_path.write_text(new_content, encoding='utf-8')
                 logger.info(f"✅ Очищен {file_path}")
                 
             except Exception as e:
@@ -171,36 +249,76 @@ auth_*.txt
             
         try:
             content = file_path.read_text(encoding='utf-8')
-            lines = content.split('\n')
+            try:
+                cleaned = self._drop_duplicate_classes_ast(content)
+            except SyntaxError:
+                # Файл не разбирается — остаётся построчный поиск заголовков классов
+                cleaned = self._drop_duplicate_classes_lines(content)
             
-            # Находим и удаляем дублированные определения классов
-            cleaned_lines = []
-            skip_until_next_class = False
-            seen_classes = set()
+            if cleaned != content:
+                file_path.write_text(cleaned, encoding='utf-8')
+            logger.info("✅ Удалены дублированные классы")
             
-            for line in lines:
-                if line.strip().startswith('class '):
-                    class_name = line.strip().split()[1].split('(')[0].rstrip(':')
-                    
-                    if class_name in seen_classes:
-                        skip_until_next_class = True
-                        logger.info(f"Удаляю дублированный класс: {class_name}")
-                        continue
-                    else:
-                        seen_classes.add(class_name)
-                        skip_until_next_class = False
+        except Exception as e:
+            logger.error(f"❌ Ошибка при удалении дублей: {e}")
+    
+    def _drop_duplicate_classes_ast(self, content: str) -> str:
+        """Удаляет повторные top-level классы по диапазонам строк из AST"""
+        tree = ast.parse(content)
+        seen_classes = set()
+        drop_ranges = []
+        
+        for node in tree.body:
+            if not isinstance(node, ast.ClassDef):
+                continue
+            if node.name in seen_classes:
+                logger.info(f"Удаляю дублированный класс: {node.name}")
+                start = min([node.lineno] + [d.lineno for d in node.decorator_list])
+                drop_ranges.append((start, node.end_lineno))
+            else:
+                seen_classes.add(node.name)
+        
+        if not drop_ranges:
+            return content
+        
+        lines = content.split('\n')
+        cleaned_lines = []
+        prev_end = 0
+        for start, end in drop_ranges:
+            cleaned_lines.extend(lines[prev_end:start - 1])
+            prev_end = end
+        cleaned_lines.extend(lines[prev_end:])
+        return '\n'.join(cleaned_lines)
+    
+    def _drop_duplicate_classes_lines(self, content: str) -> str:
+        """Построчное удаление дублированных классов для неразбираемых файлов"""
+        lines = content.split('\n')
+        
+        # Находим и удаляем дублированные определения классов
+        cleaned_lines = []
+        skip_until_next_class = False
+        seen_classes = set()
+        
+        for line in lines:
+            match = _CLASS_RE.match(line)
+            if match:
+                class_name = match.group(1)
                 
-                elif line.strip().startswith('class ') or (line and not line[0].isspace() and not skip_until_next_class):
+                if class_name in seen_classes:
+                    skip_until_next_class = True
+                    logger.info(f"Удаляю дублированный класс: {class_name}")
+                    continue
+                else:
+                    seen_classes.add(class_name)
                     skip_until_next_class = False
-                
-                if not skip_until_next_class:
-                    cleaned_lines.append(line)
             
-            file_path.write_text('\n'.join(cleaned_lines), encoding='utf-8')
-            logger.info("✅ Удалены дублированные классы")
+            elif line and not line[0].isspace() and not skip_until_next_class:
+                skip_until_next_class = False
             
-        except Exception as e:
-            logger.error(f"❌ Ошибка при удалении дублей: {e}")
+            if not skip_until_next_class:
+                cleaned_lines.append(line)
+        
+        return '\n'.join(cleaned_lines)
     
     def run_emergency_cleanup(self) -> None:
         """Запускает экстренную очистку"""
@@ -7,22 +7,72 @@ import json
 import time
 import ast
 import re
+import sys
 from pathlib import Path
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
-from peft import PeftModel
+from transformers import AutoModelForCausalLM
 
-MODEL_ID = "Qwen/Qwen2.5-Coder-1.5B"
-LORA_PATH = "lora_qwen2_5_coder_1_5b_python"
+# model_loader и agent_system лежат в корне проекта
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from model_loader import MODEL_ID, LORA_PATH, STOP_STRINGS, load_tokenizer, attach_lora  # noqa: E402
+from agent_system.io_utils import write_json  # noqa: E402
+
+try:
+    import orjson
+
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    from vllm import LLM, SamplingParams
+    from vllm.lora.request import LoRARequest
+
+    VLLM_AVAILABLE = True
+except ImportError:
+    VLLM_AVAILABLE = False
+
+# Признаки проверки на SQL-инъекции (ищутся в коде в нижнем регистре):
+# одна альтернация — один линейный проход по коду
+_SQLI_PATTERNS = ["drop", "delete", "union", "--", "/*"]
+_SQLI_RE = re.compile("|".join(map(re.escape, _SQLI_PATTERNS)))
+
+
+def _has_sqli_checks(lowered):
+    """Есть ли в коде (в нижнем регистре) признаки проверки на SQL-инъекции"""
+    return _SQLI_RE.search(lowered) is not None
+
+
+# Проверки по задачам: правило получает (code, code.lower()) и возвращает
+# текст проблемы или None
+CHECKS = {
+    "agent_health_check": [
+        lambda code, lowered: "Missing return statement" if "return" not in code else None,
+        lambda code, lowered: "Should return dict" if "dict" not in code and "{" not in code else None,
+    ],
+    "circuit_breaker_pattern": [
+        lambda code, lowered: "Missing instance variables" if "self." not in code else None,
+        lambda code, lowered: "Missing state management" if "state" not in lowered else None,
+    ],
+    "sql_injection_validator": [
+        lambda code, lowered: None if _has_sqli_checks(lowered) else "Missing SQL injection checks",
+    ],
+    "rate_limiter_decorator": [
+        lambda code, lowered: "Not a proper decorator" if "@" not in code or "def " not in code else None,
+    ],
+    "log_sanitizer": [
+        lambda code, lowered: (
+            "Missing pattern matching for sanitization" if "re" not in code and "replace" not in code else None
+        ),
+    ],
+}
 
 
 def load_model():
     """Загрузка модели с LoRA"""
     print("Loading model...")
     
-    tokenizer = AutoTokenizer.from_pretrained(LORA_PATH, use_fast=True)
-    if tokenizer.pad_token is None:
-        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer = load_tokenizer()
     
     model = AutoModelForCausalLM.from_pretrained(
         MODEL_ID,
@@ -32,93 +82,106 @@ def load_model():
         low_cpu_mem_usage=True,
     )
     
-    model = PeftModel.from_pretrained(model, LORA_PATH)
+    model = attach_lora(model)
     model.eval()
     
     return model, tokenizer
 
 
+@torch.inference_mode()
 def generate_code(model, tokenizer, prompt, max_tokens=200):
-    """Генерация кода"""
+    """Генерация кода; возвращает только продолжение промпта"""
     inputs = tokenizer(prompt, return_tensors="pt")
     
     start_time = time.time()
-    with torch.no_grad():
-        outputs = model.generate(
-            **inputs,
-            max_new_tokens=max_tokens,
-            temperature=0.3,  # Более детерминированная генерация
-            top_p=0.9,
-            do_sample=True,
-            pad_token_id=tokenizer.pad_token_id,
-        )
+    outputs = model.generate(
+        **inputs,
+        max_new_tokens=max_tokens,
+        do_sample=False,  # Жадное декодирование: детерминированная оценка
+        num_beams=1,
+        pad_token_id=tokenizer.pad_token_id,
+        stop_strings=STOP_STRINGS,
+        tokenizer=tokenizer,
+        return_dict_in_generate=False,
+    )
     gen_time = time.time() - start_time
     
-    generated = tokenizer.decode(outputs[0], skip_special_tokens=True)
+    # Декодируем только новые токены — промпт уже известен
+    new_ids = outputs[0, inputs["input_ids"].shape[1]:]
+    generated = tokenizer.decode(new_ids, skip_special_tokens=True)
     return generated, gen_time
 
 
+def generate_all_vllm(tasks, max_tokens=200):
+    """Генерация по всем задачам одним вызовом vLLM (PagedAttention, continuous batching).
+
+    Возвращает список (generated, gen_time) в порядке задач; время — доля
+    общего времени батча на задачу.
+    """
+    print("Loading model (vLLM)...")
+    llm = LLM(model=MODEL_ID, enable_lora=True)
+    lora_request = LoRARequest("lora", 1, LORA_PATH)
+    # Жадное декодирование, как и в generate_code
+    sampling_params = SamplingParams(temperature=0.0, max_tokens=max_tokens, stop=STOP_STRINGS)
+    
+    start_time = time.time()
+    outputs = llm.generate([task['prompt'] for task in tasks], sampling_params, lora_request=lora_request)
+    gen_time = (time.time() - start_time) / max(len(tasks), 1)
+    
+    return [(output.outputs[0].text, gen_time) for output in outputs]
+
+
 def check_syntax(code):
     """Проверка синтаксиса Python"""
+    syntax_ok, syntax_msg, _ = analyze(code)
+    return syntax_ok, syntax_msg
+
+
+def analyze(code):
+    """Один разбор кода для всех проверок: (синтаксис ок, сообщение, code.lower())"""
     try:
         ast.parse(code)
-        return True, "Valid syntax"
+        syntax_ok, syntax_msg = True, "Valid syntax"
     except SyntaxError as e:
-        return False, f"Syntax error: {e}"
+        syntax_ok, syntax_msg = False, f"Syntax error: {e}"
+    return syntax_ok, syntax_msg, code.lower()
 
 
-def analyze_code_quality(code, task_id):
+def analyze_code_quality(code, task_id, lowered=None):
     """Анализ качества кода для конкретной задачи"""
     issues = []
+    if lowered is None:
+        lowered = code.lower()
+    stripped_len = len(code.strip())
     
     # Общие проверки
-    if len(code.strip()) < 50:
+    if stripped_len < 50:
         issues.append("Code too short")
     
-    if "pass" in code and len(code.strip()) < 100:
+    if "pass" in code and stripped_len < 100:
         issues.append("Placeholder implementation")
     
     # Специфичные проверки по задачам
-    if task_id == "agent_health_check":
-        if "return" not in code:
-            issues.append("Missing return statement")
-        if "dict" not in code and "{" not in code:
-            issues.append("Should return dict")
-    
-    elif task_id == "circuit_breaker_pattern":
-        if "self." not in code:
-            issues.append("Missing instance variables")
-        if "state" not in code.lower():
-            issues.append("Missing state management")
-    
-    elif task_id == "sql_injection_validator":
-        dangerous_patterns = ["drop", "delete", "union", "--", "/*"]
-        if not any(pattern in code.lower() for pattern in dangerous_patterns):
-            issues.append("Missing SQL injection checks")
-    
-    elif task_id == "rate_limiter_decorator":
-        if "@" not in code or "def " not in code:
-            issues.append("Not a proper decorator")
-    
-    elif task_id == "log_sanitizer":
-        if "re" not in code and "replace" not in code:
-            issues.append("Missing pattern matching for sanitization")
+    for rule in CHECKS.get(task_id, ()):
+        issue = rule(code, lowered)
+        if issue:
+            issues.append(issue)
     
     return issues
 
 
-def evaluate_task(model, tokenizer, task):
-    """Оценка одной задачи"""
+def evaluate_task(model, tokenizer, task, generation=None):
+    """Оценка одной задачи; generation — готовый (generated, gen_time), если уже сгенерировано"""
     print(f"\n{'='*60}")
     print(f"Task: {task['id']} ({task['domain']})")
     print(f"{'='*60}")
     print(f"Prompt:\n{task['prompt'][:200]}...")
     
     # Генерация
-    generated, gen_time = generate_code(model, tokenizer, task['prompt'])
-    
-    # Извлекаем только новый код (после промпта)
-    new_code = generated[len(task['prompt']):].strip()
+    if generation is None:
+        generation = generate_code(model, tokenizer, task['prompt'])
+    generated, gen_time = generation
+    new_code = generated.strip()
     full_code = task['prompt'] + "\n" + new_code
     
     print(f"\nGenerated ({gen_time:.1f}s):")
@@ -127,8 +190,8 @@ def evaluate_task(model, tokenizer, task):
     print("-" * 40)
     
     # Проверки
-    syntax_ok, syntax_msg = check_syntax(full_code)
-    quality_issues = analyze_code_quality(full_code, task['id'])
+    syntax_ok, syntax_msg, lowered = analyze(full_code)
+    quality_issues = analyze_code_quality(full_code, task['id'], lowered)
     
     # Оценка
     score = 0
@@ -167,20 +230,24 @@ def main():
     print("="*60)
     
     # Загрузка задач
-    tasks = []
-    with open('eval/tasks.jsonl', 'r', encoding='utf-8') as f:
-        for line in f:
-            tasks.append(json.loads(line))
+    loads = orjson.loads if ORJSON_AVAILABLE else json.loads
+    lines = Path('eval/tasks.jsonl').read_bytes().splitlines()
+    tasks = [loads(line) for line in lines if line.strip()]
     
     print(f"Loaded {len(tasks)} tasks")
     
-    # Загрузка модели
-    model, tokenizer = load_model()
+    # Генерация: vLLM обрабатывает все задачи одним батчем, иначе HF по одной
+    if VLLM_AVAILABLE:
+        model, tokenizer = None, None
+        generations = generate_all_vllm(tasks)
+    else:
+        model, tokenizer = load_model()
+        generations = [None] * len(tasks)
     
     # Оценка всех задач
     results = []
-    for task in tasks:
-        result = evaluate_task(model, tokenizer, task)
+    for task, generation in zip(tasks, generations):
+        result = evaluate_task(model, tokenizer, task, generation)
         results.append(result)
     
     # Итоговая статистика
@@ -188,46 +255,45 @@ def main():
     print("FINAL RESULTS")
     print("="*60)
     
-    total_score = sum(r['score'] for r in results)
-    max_total = sum(r['max_score'] for r in results)
-    
-    syntax_ok = sum(1 for r in results if r['syntax_valid'])
-    avg_time = sum(r['generation_time'] for r in results) / len(results)
+    # Вся статистика — за один проход по результатам
+    total_score = max_total = syntax_ok = 0
+    time_sum = 0.0
+    domains = {}
+    for result in results:
+        total_score += result['score']
+        max_total += result['max_score']
+        syntax_ok += result['syntax_valid']
+        time_sum += result['generation_time']
+        stats = domains.setdefault(result['domain'], {'count': 0, 'score': 0, 'max_score': 0})
+        stats['count'] += 1
+        stats['score'] += result['score']
+        stats['max_score'] += result['max_score']
+    avg_time = time_sum / len(results)
     
     print(f"Overall Score: {total_score}/{max_total} ({total_score/max_total*100:.1f}%)")
     print(f"Syntax Valid: {syntax_ok}/{len(results)} ({syntax_ok/len(results)*100:.1f}%)")
     print(f"Avg Generation Time: {avg_time:.1f}s")
     
-    # По доменам
-    domains = {}
-    for result in results:
-        domain = result['domain']
-        if domain not in domains:
-            domains[domain] = {'count': 0, 'score': 0, 'max_score': 0}
-        domains[domain]['count'] += 1
-        domains[domain]['score'] += result['score']
-        domains[domain]['max_score'] += result['max_score']
-    
     print(f"\nBy Domain:")
     for domain, stats in domains.items():
         pct = stats['score'] / stats['max_score'] * 100
         print(f"  {domain}: {stats['score']}/{stats['max_score']} ({pct:.1f}%)")
     
     # Сохранение результатов
-    with open('eval/real_world_results.json', 'w', encoding='utf-8') as f:
-        json.dump({
-            'summary': {
-                'total_score': total_score,
-                'max_score': max_total,
-                'percentage': total_score/max_total*100,
-                'syntax_valid': syntax_ok,
-                'total_tasks': len(results),
-                'avg_time': avg_time,
-                'domains': domains
-            },
-            'results': results,
-            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
-        }, f, indent=2, ensure_ascii=False)
+    payload = {
+        'summary': {
+            'total_score': total_score,
+            'max_score': max_total,
+            'percentage': total_score/max_total*100,
+            'syntax_valid': syntax_ok,
+            'total_tasks': len(results),
+            'avg_time': avg_time,
+            'domains': domains
+        },
+        'results': results,
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
+    }
+    write_json('eval/real_world_results.json', payload)
     
     print(f"\nDetailed results saved to eval/real_world_results.json")
 
@@ -11,32 +11,42 @@
 
 import os
 import torch
+from contextlib import contextmanager
 import json
 import time
 from pathlib import Path
-from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
-from peft import PeftModel
+from transformers import AutoModelForCausalLM, BitsAndBytesConfig
 from datasets import load_from_disk
 import math
+from model_loader import (
+    MODEL_ID, LORA_PATH, PPL_BATCH_SIZE, STOP_STRINGS,
+    load_tokenizer, attach_lora, pad_batch, sum_token_loss,
+)
+
+try:
+    import flash_attn  # noqa: F401
+
+    FLASH_ATTN_AVAILABLE = True
+except ImportError:
+    FLASH_ATTN_AVAILABLE = False
 
 # Пути
-MODEL_ID = "Qwen/Qwen2.5-Coder-1.5B"
-LORA_PATH = "lora_qwen2_5_coder_1_5b_python"
 DATA_DIR = "codesearchnet_python_1pct_filtered"
 
 os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "expandable_segments:True"
 
 
-def load_model(use_lora=True):
-    """Загрузка модели с или без LoRA"""
+def load_model(use_lora=True, merge=False):
+    """Загрузка модели с или без LoRA
+    
+    Веса базовой модели квантованы в 4-bit NF4, поэтому LoRA по умолчанию
+    не вливается: merge_and_unload деквантует слой, прибавляет дельту и
+    квантует обратно, и ошибка округления искажает обученный адаптер —
+    а с ним и сравнение LoRA с базовой моделью.
+    """
     print(f"Loading model (LoRA: {use_lora})...")
     
-    tokenizer = AutoTokenizer.from_pretrained(
-        LORA_PATH if use_lora else MODEL_ID, 
-        use_fast=True
-    )
-    if tokenizer.pad_token is None:
-        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer = load_tokenizer(use_lora)
     
     bnb_config = BitsAndBytesConfig(
         load_in_4bit=True,
@@ -45,106 +55,186 @@ def load_model(use_lora=True):
         bnb_4bit_use_double_quant=True,
     )
     
-    model = AutoModelForCausalLM.from_pretrained(
-        MODEL_ID,
+    # Fused-ядро внимания: FlashAttention-2 на CUDA, иначе встроенный SDPA
+    attn_implementation = "flash_attention_2" if FLASH_ATTN_AVAILABLE and torch.cuda.is_available() else "sdpa"
+    load_kwargs = dict(
         quantization_config=bnb_config,
         device_map="auto",
         trust_remote_code=True,
         torch_dtype=torch.float16,
     )
+    try:
+        model = AutoModelForCausalLM.from_pretrained(
+            MODEL_ID, attn_implementation=attn_implementation, **load_kwargs
+        )
+    except (ImportError, ValueError) as e:
+        if attn_implementation == "sdpa":
+            raise
+        # flash-attn собран не под эту CUDA/GPU
+        print(f"⚠️ flash_attention_2 unavailable ({e}), falling back to sdpa")
+        attn_implementation = "sdpa"
+        model = AutoModelForCausalLM.from_pretrained(
+            MODEL_ID, attn_implementation=attn_implementation, **load_kwargs
+        )
+    print(f"Attention implementation: {attn_implementation}")
     
     if use_lora:
-        model = PeftModel.from_pretrained(model, LORA_PATH)
-        print("LoRA adapter loaded!")
+        model = attach_lora(model, merge)
     
     model.eval()
+    
+    if torch.cuda.is_available():
+        # TorchInductor + CUDA graphs убирают Python-диспетчеризацию на шагах декодирования.
+        # Компилируем forward модуля, который вызывает generate(): у PeftModel
+        # это внутренняя модель с внедрёнными LoRA-слоями, а не сам PeftModel
+        target = _generation_module(model)
+        target.forward = torch.compile(target.forward, mode="reduce-overhead", fullgraph=False)
+    
     return model, tokenizer
 
 
+def _generation_module(model):
+    """Модуль, чей forward вызывает generate(): базовая модель PeftModel или сама модель"""
+    get_base_model = getattr(model, "get_base_model", None)
+    return get_base_model() if get_base_model is not None else model
+
+
+@contextmanager
+def eager_forward(model):
+    """Временно возвращает некомпилированный forward
+    
+    Бакеты perplexity разной формы: CUDA-graph forward перекомпилировался
+    бы и захватывал новый граф на каждую пару (батч, длина).
+    """
+    target = _generation_module(model)
+    compiled = target.__dict__.pop("forward", None)
+    try:
+        yield
+    finally:
+        if compiled is not None:
+            target.forward = compiled
+
+
+@torch.inference_mode()
 def calculate_perplexity(model, tokenizer, texts, max_samples=100):
     """Вычисление perplexity на тестовых данных"""
-    print(f"\nCalculating perplexity on {min(len(texts), max_samples)} samples...")
+    # Токенизируем всё одним вызовом и сортируем по числу токенов:
+    # в батч попадают последовательности близкой длины, паддинга почти нет
+    encoded = tokenizer(
+        list(texts[:max_samples]),
+        truncation=True,
+        max_length=512
+    )["input_ids"]
+    encoded.sort(key=len)
+    print(f"\nCalculating perplexity on {len(encoded)} samples...")
     
-    total_loss = 0
-    total_tokens = 0
+    # Накопители остаются тензорами: одна синхронизация .item() в конце
+    total_loss = torch.zeros((), device=model.device)
+    total_tokens = torch.zeros((), dtype=torch.long, device=model.device)
     
-    for i, text in enumerate(texts[:max_samples]):
-        if i % 20 == 0:
-            print(f"  Processing {i}/{min(len(texts), max_samples)}...")
-        
-        try:
-            inputs = tokenizer(
-                text, 
-                return_tensors="pt", 
-                truncation=True, 
-                max_length=512
-            ).to(model.device)
+    with eager_forward(model):
+        for start in range(0, len(encoded), PPL_BATCH_SIZE):
+            print(f"  Processing {start}/{len(encoded)}...")
             
-            with torch.no_grad():
-                outputs = model(**inputs, labels=inputs["input_ids"])
-                loss = outputs.loss.item()
+            try:
+                input_ids, attention_mask = pad_batch(encoded[start:start + PPL_BATCH_SIZE], tokenizer.pad_token_id)
                 
-            num_tokens = inputs["input_ids"].shape[1]
-            total_loss += loss * num_tokens
-            total_tokens += num_tokens
-            
-        except Exception as e:
-            print(f"  Error on sample {i}: {e}")
-            continue
+                loss_sum, num_tokens = sum_token_loss(
+                    model, input_ids.to(model.device), attention_mask.to(model.device)
+                )
+                    
+                total_loss += loss_sum
+                total_tokens += num_tokens
+                
+            except Exception as e:
+                print(f"  Error on batch {start}: {e}")
+                continue
     
+    total_loss, total_tokens = total_loss.item(), total_tokens.item()
     avg_loss = total_loss / total_tokens if total_tokens > 0 else float('inf')
     perplexity = math.exp(avg_loss)
     
     return perplexity, avg_loss
 
 
-def generate_code(model, tokenizer, prompt, max_new_tokens=150):
-    """Генерация кода по промпту"""
-    inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+@torch.inference_mode()
+def generate_batch(model, tokenizer, prompts, max_new_tokens=150):
+    """Генерация по всем промптам одним вызовом generate().
+
+    Промпты выравниваются паддингом слева; возвращает id новых токенов для
+    каждого промпта (обрезанные по первому eos/pad) и общее время генерации.
+    """
+    # Токенизатор общий (lru_cache в model_loader): меняем сторону паддинга
+    # только на время этого вызова, остальные пользователи её не увидят
+    padding_side = tokenizer.padding_side
+    tokenizer.padding_side = "left"
+    try:
+        inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(model.device)
+    finally:
+        tokenizer.padding_side = padding_side
+    
+    # Статический KV-кэш фиксирует формы тензоров для CUDA graphs
+    cache_kwargs = {"cache_implementation": "static"} if torch.cuda.is_available() else {}
     
     start_time = time.time()
-    with torch.no_grad():
-        outputs = model.generate(
-            **inputs,
-            max_new_tokens=max_new_tokens,
-            temperature=0.7,
-            top_p=0.9,
-            do_sample=True,
-            pad_token_id=tokenizer.pad_token_id,
-            eos_token_id=tokenizer.eos_token_id,
-        )
+    outputs = model.generate(
+        **inputs,
+        max_new_tokens=max_new_tokens,
+        do_sample=False,  # Жадное декодирование: детерминированная оценка
+        num_beams=1,
+        pad_token_id=tokenizer.pad_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        stop_strings=STOP_STRINGS,
+        tokenizer=tokenizer,
+        **cache_kwargs,
+    )
     gen_time = time.time() - start_time
     
-    generated = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    new_tokens = outputs.shape[1] - inputs["input_ids"].shape[1]
+    stop_ids = {tokenizer.eos_token_id, tokenizer.pad_token_id}
+    completions = []
+    for row in outputs[:, inputs["input_ids"].shape[1]:].tolist():
+        end = next((pos for pos, token in enumerate(row) if token in stop_ids), len(row))
+        completions.append(row[:end])
     
-    return generated, gen_time, new_tokens
+    return completions, gen_time
 
 
 def evaluate_code_completion(model, tokenizer, test_cases):
     """Оценка качества code completion"""
     results = []
     
-    for i, case in enumerate(test_cases):
+    # Все кейсы генерируются одним батчем: веса читаются один раз на шаг
+    # декодирования для всех последовательностей
+    prompts = [case['prompt'] for case in test_cases]
+    max_new_tokens = max(case.get('max_tokens', 150) for case in test_cases)
+    
+    if torch.cuda.is_available():
+        # Первый вызов скомпилированной модели долгий — прогреваем вне замеров
+        print("Warming up compiled model...")
+        generate_batch(model, tokenizer, prompts, max_new_tokens=max_new_tokens)
+    
+    completions, batch_time = generate_batch(model, tokenizer, prompts, max_new_tokens=max_new_tokens)
+    print(f"\nBatch of {len(test_cases)} generated in {batch_time:.2f}s")
+    
+    for i, (case, new_ids) in enumerate(zip(test_cases, completions)):
+        # Бюджет токенов у каждого кейса свой — обрезаем общий батч
+        new_ids = new_ids[:case.get('max_tokens', 150)]
+        generated = case['prompt'] + tokenizer.decode(new_ids, skip_special_tokens=True)
+        gen_time = batch_time / len(test_cases)
+        
         print(f"\n{'='*60}")
         print(f"Test Case {i+1}: {case['name']}")
         print(f"{'='*60}")
         print(f"Prompt:\n{case['prompt']}")
-        
-        generated, gen_time, new_tokens = generate_code(
-            model, tokenizer, case['prompt'], 
-            max_new_tokens=case.get('max_tokens', 150)
-        )
-        
         print(f"\nGenerated:\n{generated}")
-        print(f"\nTime: {gen_time:.2f}s, Tokens: {new_tokens}")
+        print(f"\nTime (batch share): {gen_time:.2f}s, Tokens: {len(new_ids)}")
         
         results.append({
             'name': case['name'],
             'prompt': case['prompt'],
             'generated': generated,
             'time': gen_time,
-            'tokens': new_tokens
+            'tokens': len(new_ids)
         })
     
     return results
@@ -206,7 +296,7 @@ def main():
     
     try:
         ds = load_from_disk(DATA_DIR)
-        texts = [item['text'] for item in ds]
+        texts = ds['text']  # колонка целиком, без построения dict на каждую строку
         
         ppl_lora, loss_lora = calculate_perplexity(model_lora, tokenizer, texts, max_samples=50)
         print(f"\nLoRA Model Perplexity: {ppl_lora:.2f}")
@@ -1,67 +1,170 @@
 #!/usr/bin/env python3
 """
-Оценка LoRA модели на CPU (без квантизации)
+Оценка LoRA модели на CPU (bf16 или динамическая int8-квантизация)
 Для машин без CUDA
 """
 
 import os
+import shutil
 import torch
 import json
 import time
-from transformers import AutoTokenizer, AutoModelForCausalLM
-from peft import PeftModel
+from pathlib import Path
+from transformers import AutoModelForCausalLM
 from datasets import load_from_disk
 import math
+from model_loader import (
+    MODEL_ID, LORA_PATH, PPL_BATCH_SIZE, STOP_STRINGS,
+    load_tokenizer, attach_lora, pad_batch, sum_token_loss,
+)
+
+try:
+    from optimum.onnxruntime import ORTModelForCausalLM, ORTOptimizer
+    from optimum.onnxruntime.configuration import OptimizationConfig
+
+    OPTIMUM_AVAILABLE = True
+except ImportError:
+    OPTIMUM_AVAILABLE = False
 
-MODEL_ID = "Qwen/Qwen2.5-Coder-1.5B"
-LORA_PATH = "lora_qwen2_5_coder_1_5b_python"
 DATA_DIR = "codesearchnet_python_1pct_filtered"
+ONNX_DIR = "lora_qwen2_5_coder_1_5b_python_onnx"
+ONNX_FILE = "model_optimized.onnx"
+# Отпечаток базовой модели и адаптера, из которых собран ONNX_FILE
+ONNX_SOURCE_FILE = "source.json"
+
+# Все ядра на intra-op, без межоперационного параллелизма — иначе потоки конкурируют
+torch.set_num_threads(os.cpu_count())
+torch.set_num_interop_threads(1)
+
+
+def cpu_supports_bf16():
+    """Есть ли у CPU аппаратный bf16 (AVX512_BF16 или AMX)
+    
+    Одного AVX-512 мало: на Skylake-X и Cascade Lake bf16 эмулируется
+    и работает медленнее int8.
+    """
+    try:
+        return torch.cpu._is_avx512_bf16_supported() or torch.cpu._is_amx_tile_supported()
+    except AttributeError:
+        pass
+    
+    # Старый torch без этих проверок: смотрим флаги процессора (Linux)
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return not {"avx512_bf16", "amx_bf16"}.isdisjoint(line.split())
+    except OSError:
+        pass
+    return False
 
 
-def load_model(use_lora=True):
+def load_model(use_lora=True, merge=True):
     """Загрузка модели на CPU"""
     print(f"Loading model on CPU (LoRA: {use_lora})...")
-    print("This may take a while and use significant RAM (~6GB)...")
+    use_bf16 = cpu_supports_bf16()
+    print(f"Weights dtype: {'bfloat16' if use_bf16 else 'int8 (dynamic quantization)'}")
+    print("This may take a while and use significant RAM (~3GB)...")
     
-    tokenizer = AutoTokenizer.from_pretrained(
-        LORA_PATH if use_lora else MODEL_ID, 
-        use_fast=True
-    )
-    if tokenizer.pad_token is None:
-        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer = load_tokenizer(use_lora)
     
-    # Загрузка без квантизации на CPU
+    # Декодирование на CPU упирается в пропускную способность памяти:
+    # bf16 вдвое меньше байт весов, чем float32
     model = AutoModelForCausalLM.from_pretrained(
         MODEL_ID,
         device_map="cpu",
         trust_remote_code=True,
-        torch_dtype=torch.float32,  # CPU работает лучше с float32
+        torch_dtype=torch.bfloat16 if use_bf16 else torch.float32,
         low_cpu_mem_usage=True,
     )
     
     if use_lora:
-        model = PeftModel.from_pretrained(model, LORA_PATH)
-        print("LoRA adapter loaded!")
+        model = attach_lora(model, merge)
+    
+    if not use_bf16:
+        # Без аппаратного bf16 квантуем Linear-слои в int8 (вчетверо меньше float32)
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
     
     model.eval()
     return model, tokenizer
 
 
+def adapter_fingerprint():
+    """Базовая модель и (имя, размер, mtime) файлов адаптера одной строкой"""
+    files = sorted(
+        (path.name, path.stat().st_size, path.stat().st_mtime_ns)
+        for path in Path(LORA_PATH).iterdir() if path.is_file()
+    )
+    return json.dumps({"model": MODEL_ID, "adapter": files})
+
+
+def load_onnx_model():
+    """ONNX Runtime версия слитой LoRA-модели для генерации.
+
+    Слитая float32-модель экспортируется в ONNX и оптимизируется (фьюзинг
+    attention/LayerNorm/GELU), затем берётся из ONNX_DIR, пока отпечаток
+    базовой модели и адаптера не изменится — переобученный адаптер
+    экспортируется заново.
+    """
+    onnx_dir = Path(ONNX_DIR)
+    source_path = onnx_dir / ONNX_SOURCE_FILE
+    fingerprint = adapter_fingerprint()
+    
+    up_to_date = (
+        (onnx_dir / ONNX_FILE).exists()
+        and source_path.exists()
+        and source_path.read_text(encoding="utf-8") == fingerprint
+    )
+    if not up_to_date:
+        print(f"Exporting merged model to ONNX ({onnx_dir})...")
+        shutil.rmtree(onnx_dir, ignore_errors=True)
+        merged_dir = onnx_dir / "merged"
+        
+        tokenizer = load_tokenizer()
+        base = AutoModelForCausalLM.from_pretrained(
+            MODEL_ID,
+            trust_remote_code=True,
+            torch_dtype=torch.float32,
+            low_cpu_mem_usage=True,
+        )
+        merged = attach_lora(base)
+        merged.save_pretrained(merged_dir)
+        tokenizer.save_pretrained(merged_dir)
+        del base, merged
+        
+        ort_model = ORTModelForCausalLM.from_pretrained(
+            merged_dir, export=True, provider="CPUExecutionProvider"
+        )
+        optimizer = ORTOptimizer.from_pretrained(ort_model)
+        optimizer.optimize(
+            save_dir=onnx_dir,
+            optimization_config=OptimizationConfig(optimization_level=99, fp16=False, optimize_for_gpu=False),
+        )
+        # Отпечаток пишется последним: прерванный экспорт повторится
+        source_path.write_text(fingerprint, encoding="utf-8")
+    
+    print("Loading ONNX Runtime model...")
+    return ORTModelForCausalLM.from_pretrained(
+        onnx_dir, file_name=ONNX_FILE, provider="CPUExecutionProvider"
+    )
+
+
+@torch.inference_mode()
 def generate_code(model, tokenizer, prompt, max_new_tokens=100):
     """Генерация кода"""
     inputs = tokenizer(prompt, return_tensors="pt")
     
     start_time = time.time()
-    with torch.no_grad():
-        outputs = model.generate(
-            **inputs,
-            max_new_tokens=max_new_tokens,
-            temperature=0.7,
-            top_p=0.9,
-            do_sample=True,
-            pad_token_id=tokenizer.pad_token_id,
-            eos_token_id=tokenizer.eos_token_id,
-        )
+    outputs = model.generate(
+        **inputs,
+        max_new_tokens=max_new_tokens,
+        do_sample=False,  # Жадное декодирование: детерминированная оценка
+        num_beams=1,
+        pad_token_id=tokenizer.pad_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        stop_strings=STOP_STRINGS,
+        tokenizer=tokenizer,
+    )
     gen_time = time.time() - start_time
     
     generated = tokenizer.decode(outputs[0], skip_special_tokens=True)
@@ -70,37 +173,41 @@ def generate_code(model, tokenizer, prompt, max_new_tokens=100):
     return generated, gen_time, new_tokens
 
 
+@torch.inference_mode()
 def calculate_perplexity(model, tokenizer, texts, max_samples=20):
     """Perplexity на небольшой выборке"""
-    print(f"\nCalculating perplexity on {min(len(texts), max_samples)} samples...")
+    # Токенизируем всё одним вызовом и сортируем по числу токенов:
+    # в батч попадают последовательности близкой длины, паддинга почти нет
+    encoded = tokenizer(
+        list(texts[:max_samples]),
+        truncation=True,
+        max_length=256  # Меньше для CPU
+    )["input_ids"]
+    encoded.sort(key=len)
+    print(f"\nCalculating perplexity on {len(encoded)} samples...")
     
-    total_loss = 0
-    total_tokens = 0
+    # Накопители остаются тензорами: одна синхронизация .item() в конце
+    total_loss = torch.zeros((), device=model.device)
+    total_tokens = torch.zeros((), dtype=torch.long, device=model.device)
     
-    for i, text in enumerate(texts[:max_samples]):
-        if i % 5 == 0:
-            print(f"  Processing {i}/{min(len(texts), max_samples)}...")
+    for start in range(0, len(encoded), PPL_BATCH_SIZE):
+        print(f"  Processing {start}/{len(encoded)}...")
         
         try:
-            inputs = tokenizer(
-                text, 
-                return_tensors="pt", 
-                truncation=True, 
-                max_length=256  # Меньше для CPU
-            )
+            input_ids, attention_mask = pad_batch(encoded[start:start + PPL_BATCH_SIZE], tokenizer.pad_token_id)
             
-            with torch.no_grad():
-                outputs = model(**inputs, labels=inputs["input_ids"])
-                loss = outputs.loss.item()
+            loss_sum, num_tokens = sum_token_loss(
+                model, input_ids.to(model.device), attention_mask.to(model.device)
+            )
                 
-            num_tokens = inputs["input_ids"].shape[1]
-            total_loss += loss * num_tokens
+            total_loss += loss_sum
             total_tokens += num_tokens
             
         except Exception as e:
-            print(f"  Error: {e}")
+            print(f"  Error on batch {start}: {e}")
             continue
     
+    total_loss, total_tokens = total_loss.item(), total_tokens.item()
     avg_loss = total_loss / total_tokens if total_tokens > 0 else float('inf')
     perplexity = math.exp(avg_loss)
     
@@ -141,6 +248,9 @@ def main():
     # Загружаем модель
     model, tokenizer = load_model(use_lora=True)
     
+    # Генерация через ONNX Runtime, если установлен optimum; perplexity — на PyTorch модели
+    gen_model = load_onnx_model() if OPTIMUM_AVAILABLE else model
+    
     # 1. Code completion
     print("\n" + "="*60)
     print("1. CODE COMPLETION TESTS")
@@ -152,7 +262,7 @@ def main():
         print(f"Prompt: {case['prompt']}")
         
         generated, gen_time, new_tokens = generate_code(
-            model, tokenizer, case['prompt'], case['max_tokens']
+            gen_model, tokenizer, case['prompt'], case['max_tokens']
         )
         
         print(f"\nGenerated ({gen_time:.1f}s, {new_tokens} tokens):")
@@ -174,7 +284,7 @@ def main():
     
     try:
         ds = load_from_disk(DATA_DIR)
-        texts = [item['text'] for item in ds]
+        texts = ds['text']  # колонка целиком, без построения dict на каждую строку
         
         ppl, loss = calculate_perplexity(model, tokenizer, texts, max_samples=20)
         print(f"\nPerplexity: {ppl:.2f}")
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Общая загрузка токенизатора и LoRA-адаптера для скриптов оценки
+
+evaluate_lora.py, evaluate_lora_cpu.py и eval/real_world_eval.py собирают
+базовую модель по-своему (4-bit на GPU, bf16/int8 или float32 на CPU),
+а токенизатор, подключение адаптера и подсчёт loss для perplexity берут отсюда.
+"""
+
+import os
+from functools import lru_cache
+
+import torch
+import torch.nn.functional as F
+from transformers import AutoTokenizer
+from peft import PeftModel
+
+# Разрешаем Rust-токенизатору параллелить батчевое кодирование
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
+
+MODEL_ID = "Qwen/Qwen2.5-Coder-1.5B"
+LORA_PATH = "lora_qwen2_5_coder_1_5b_python"
+
+# Размер батча при подсчёте perplexity
+PPL_BATCH_SIZE = 8
+
+# Две пустые строки подряд — блок кода завершён, дальше генерировать незачем
+STOP_STRINGS = ["\n\n\n"]
+
+
+@lru_cache(maxsize=2)
+def load_tokenizer(use_lora=True):
+    """Быстрый токенизатор адаптера (или базовой модели); один экземпляр на процесс"""
+    tokenizer = AutoTokenizer.from_pretrained(
+        LORA_PATH if use_lora else MODEL_ID,
+        use_fast=True
+    )
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    return tokenizer
+
+
+def attach_lora(model, merge=True):
+    """Подключение LoRA-адаптера к базовой модели
+    
+    merge=True только для bf16/fp16/float32 весов: у 4-bit модели слияние
+    переквантует слои, и оценивается уже не обученный адаптер.
+    """
+    model = PeftModel.from_pretrained(model, LORA_PATH)
+    print("LoRA adapter loaded!")
+    if merge:
+        # Для инференса вливаем LoRA в базовые веса: без лишних матмулов адаптера
+        model = model.merge_and_unload()
+        print("LoRA adapter merged into base weights")
+    return model
+
+
+def pad_batch(batch, pad_token_id):
+    """Паддинг справа списков id токенов; тензоры строятся напрямую через torch.as_tensor"""
+    width = max(len(ids) for ids in batch)
+    input_ids = torch.full((len(batch), width), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(batch), width), dtype=torch.long)
+    for row, ids in enumerate(batch):
+        input_ids[row, :len(ids)] = torch.as_tensor(ids, dtype=torch.long)
+        attention_mask[row, :len(ids)] = 1
+    return input_ids, attention_mask
+
+
+def sum_token_loss(model, input_ids, attention_mask):
+    """Сумма cross-entropy по всем непаддинговым токенам батча и их число"""
+    # Позиции считаются по маске, чтобы паддинг с любой стороны не сдвигал их
+    position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+    logits = model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids).logits
+    
+    # Токен t+1 предсказывается по позиции t; учитываем пары, где оба токена реальные
+    valid = attention_mask[:, 1:].bool() & attention_mask[:, :-1].bool()
+    labels = input_ids[:, 1:].masked_fill(~valid, -100)
+    loss = F.cross_entropy(
+        logits[:, :-1, :].reshape(-1, logits.size(-1)).float(),
+        labels.reshape(-1),
+        ignore_index=-100,
+        reduction="sum",
+    )
+    return loss, valid.sum()
@@ -3,13 +3,19 @@
 СИСТЕМА ОЧИСТКИ ПРОЕКТА
 Удаление неактуальных документов, дублированного кода и оптимизация структуры
 """
+import asyncio
 import os
 import shutil
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
-from typing import List, Dict, Set, Tuple
+from typing import List, Dict, Optional, Set, Tuple
 import logging
 import re
 import ast
+import hashlib
+import heapq
+import json
 from datetime import datetime
 
 # Настройка логирования
@@ -19,6 +25,185 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Импорты верхнего уровня (строка целиком), серии пустых строк и переводы строк
+_IMPORT_RE = re.compile(r'^(?:import|from) [^\n]*$', re.M)
+_EXTRA_BLANK_LINES_RE = re.compile(r'\n\s*\n\s*\n')
+_NEWLINE_RE = re.compile(r'\n')
+
+# Кэш результатов разбора AST: каталог в корне проекта и предел числа записей
+AST_CACHE_DIR = ".cleanup_cache"
+AST_CACHE_MAX_ENTRIES = 1000
+
+# Файлы крупнее (сгенерированные стабы и т.п.) не разбираем: дублей там почти нет,
+# а ast.parse обходится дорого
+MAX_CLEAN_FILE_SIZE = 1_000_000
+
+
+def _remove_duplicate_imports(content: str) -> str:
+    """Удаляет повторные импорты верхнего уровня, оставляя первое вхождение"""
+    seen_imports = set()
+    kept = []
+    pos = 0
+    for match in _IMPORT_RE.finditer(content):
+        line = match.group().rstrip()
+        # Многострочный импорт целиком одной строкой не вырезать
+        if line.endswith(('(', '\\')):
+            continue
+        if line in seen_imports:
+            kept.append(content[pos:match.start()])
+            pos = match.end() + 1  # вместе с переводом строки
+            logger.debug(f"Удален дублированный импорт: {line}")
+        else:
+            seen_imports.add(line)
+    if not kept:
+        return content
+    kept.append(content[pos:])
+    return ''.join(kept)
+
+
+def _find_duplicate_ranges(content: str) -> List[Tuple[int, int]]:
+    """Диапазоны строк (с 1, включительно) повторных определений верхнего уровня"""
+    tree = ast.parse(content)
+    seen_definitions = set()
+    remove_ranges = []
+
+    # Только верхний уровень: одноимённые методы разных классов — не дубли
+    for node in tree.body:
+        if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+            # Дубль — структурно идентичное определение (имя входит в дамп),
+            # а не просто совпадение имени; в set хранится 16-байтовый отпечаток
+            definition_key = hashlib.blake2b(
+                ast.dump(node, annotate_fields=False, include_attributes=False).encode(),
+                digest_size=16,
+            ).digest()
+
+            if definition_key in seen_definitions:
+                # Вместе с декораторами, от начала первой строки до конца последней
+                start_line = min([node.lineno] + [d.lineno for d in node.decorator_list])
+                remove_ranges.append((start_line, node.end_lineno))
+                logger.info(f"Найдено дублирование: {type(node).__name__}:{node.name} на строке {node.lineno}")
+            else:
+                seen_definitions.add(definition_key)
+
+    return remove_ranges
+
+
+def _cached_duplicate_ranges(content: str, cache_dir: Optional[Path]) -> List[Tuple[int, int]]:
+    """_find_duplicate_ranges с дисковым кэшем по хэшу содержимого.
+
+    Неизменённые файлы при повторных запусках не разбираются заново; mtime
+    записи обновляется при попадании и служит меткой для LRU-вытеснения.
+    """
+    if cache_dir is None:
+        return _find_duplicate_ranges(content)
+
+    cache_file = cache_dir / hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+    try:
+        remove_ranges = [tuple(r) for r in json.loads(cache_file.read_bytes())]
+        os.utime(cache_file)
+        return remove_ranges
+    except (OSError, ValueError):
+        pass
+
+    remove_ranges = _find_duplicate_ranges(content)
+    try:
+        cache_file.write_text(json.dumps(remove_ranges), encoding='utf-8')
+    except OSError as e:
+        logger.debug(f"Не удалось записать кэш AST {cache_file}: {e}")
+    return remove_ranges
+
+
+def _remove_duplicate_definitions(content: str, cache_dir: Optional[Path] = None) -> str:
+    """Удаляет дублированные определения классов и функций верхнего уровня"""
+    # Без определений разбирать нечего
+    if 'def ' not in content and 'class ' not in content:
+        return content
+
+    try:
+        remove_ranges = _cached_duplicate_ranges(content, cache_dir)
+
+        # Вырезаем диапазоны по смещениям начал строк, без разбиения на список строк
+        if remove_ranges:
+            line_starts = [0] + [m.end() for m in _NEWLINE_RE.finditer(content)]
+            line_starts.append(len(content))
+            kept = []
+            pos = 0
+            # Узлы tree.body идут по порядку и не пересекаются
+            for start_line, end_line in remove_ranges:
+                kept.append(content[pos:line_starts[start_line - 1]])
+                pos = line_starts[min(end_line, len(line_starts) - 1)]
+            kept.append(content[pos:])
+            return ''.join(kept)
+
+    except SyntaxError:
+        logger.warning(f"Не удалось парсить файл для удаления дублей")
+    except Exception as e:
+        logger.error(f"Ошибка при удалении дублированных определений: {e}")
+
+    return content
+
+
+def _evict_cache(cache_dir: Path, max_entries: int = AST_CACHE_MAX_ENTRIES) -> None:
+    """Удаляет самые давно использованные записи кэша сверх max_entries"""
+    with os.scandir(cache_dir) as entries:
+        stamped = [(entry.stat().st_mtime, entry.path) for entry in entries if entry.is_file()]
+    excess = len(stamped) - max_entries
+    if excess > 0:
+        for _, path in heapq.nsmallest(excess, stamped):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+def _clean_file(file_path: Path, cache_dir: Optional[Path] = None) -> bool:
+    """Очищает дублированный код в файле; True, если файл изменён"""
+    try:
+        if file_path.stat().st_size > MAX_CLEAN_FILE_SIZE:
+            logger.debug(f"Пропущен крупный файл: {file_path}")
+            return False
+
+        original_content = file_path.read_bytes().decode('utf-8')
+
+        # Удаляем дублированные импорты
+        content = _remove_duplicate_imports(original_content)
+
+        # Удаляем дублированные определения классов и функций
+        content = _remove_duplicate_definitions(content, cache_dir)
+
+        # Шаги возвращают тот же объект, если ничего не вырезали, — файл
+        # изменён без сравнения содержимого целиком
+        changed = content is not original_content
+
+        # Удаляем лишние пустые строки (каждая замена укорачивает текст)
+        content, collapsed = _EXTRA_BLANK_LINES_RE.subn('\n\n', content)
+
+        if changed or collapsed:
+            file_path.write_bytes(content.encode('utf-8'))
+            return True
+
+    except Exception as e:
+        logger.error(f"Ошибка при очистке {file_path}: {e}")
+
+    return False
+
+
+def _clean_one(path_str: str, cache_dir: Optional[str] = None) -> Tuple[str, bool]:
+    """Очистка одного файла; вынесено на уровень модуля для ProcessPoolExecutor"""
+    return path_str, _clean_file(Path(path_str), Path(cache_dir) if cache_dir else None)
+
+
+async def _unlink_concurrently(paths: List[str]) -> List[Optional[BaseException]]:
+    """Удаляет файлы параллельно в пуле потоков; для каждого пути None или исключение.
+
+    На HDD и сетевых ФС задержки отдельных unlink перекрываются.
+    """
+    return await asyncio.gather(
+        *(asyncio.to_thread(os.unlink, path) for path in paths),
+        return_exceptions=True,
+    )
+
+
 class ProjectCleanupSystem:
     """Система комплексной очистки проекта"""
     
@@ -77,142 +262,88 @@ class ProjectCleanupSystem:
             "multiagent_quality_analysis.json",
             "security_report.json",
         ]
+        
+        # Все три списка лежат в корне: удаляются одним проходом по каталогу
+        self._targets = frozenset(self.outdated_docs) | frozenset(self.duplicate_files) | frozenset(self.temp_files)
+        self._sweep_results: Optional[Dict[str, str]] = None
+    
+    def _sweep_root(self) -> Dict[str, str]:
+        """Удаляет все файлы-цели за один проход os.scandir по корню проекта.
+
+        Возвращает {имя файла: текст ошибки или ""}; проход выполняется один
+        раз, повторные вызовы отдают сохранённый результат.
+        """
+        if self._sweep_results is None:
+            self._sweep_results = {}
+            with os.scandir(self.project_root) as entries:
+                found = [(entry.name, entry.path) for entry in entries if entry.name in self._targets]
+            
+            outcomes = asyncio.run(_unlink_concurrently([path for _, path in found]))
+            for (name, path), outcome in zip(found, outcomes):
+                if outcome is None:
+                    self.removed_files.append(Path(path))
+                    self._sweep_results[name] = ""
+                else:
+                    self._sweep_results[name] = str(outcome)
+        return self._sweep_results
+    
+    def _log_sweep(self, names: List[str], removed_message: str) -> None:
+        """Логирует результат общего прохода по одной категории файлов"""
+        results = self._sweep_root()
+        for name in names:
+            if name not in results:
+                logger.debug(f"ℹ️ Файл не найден: {name}")
+            elif results[name]:
+                logger.error(f"❌ Ошибка при удалении {name}: {results[name]}")
+            else:
+                logger.info(f"{removed_message}: {name}")
     
     def remove_outdated_documents(self) -> None:
         """Удаляет неактуальные документы"""
         logger.info("📄 Удаление неактуальных документов...")
-        
-        for doc_name in self.outdated_docs:
-            doc_path = self.project_root / doc_name
-            if doc_path.exists():
-                try:
-                    doc_path.unlink()
-                    self.removed_files.append(doc_path)
-                    logger.info(f"✅ Удален: {doc_name}")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка при удалении {doc_name}: {e}")
-            else:
-                logger.debug(f"ℹ️ Файл не найден: {doc_name}")
+        self._log_sweep(self.outdated_docs, "✅ Удален")
     
     def remove_duplicate_files(self) -> None:
         """Удаляет дублированные файлы"""
         logger.info("🔄 Удаление дублированных файлов...")
-        
-        for file_name in self.duplicate_files:
-            file_path = self.project_root / file_name
-            if file_path.exists():
-                try:
-                    file_path.unlink()
-                    self.removed_files.append(file_path)
-                    logger.info(f"✅ Удален дубль: {file_name}")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка при удалении {file_name}: {e}")
+        self._log_sweep(self.duplicate_files, "✅ Удален дубль")
     
     def remove_temp_files(self) -> None:
         """Удаляет временные файлы"""
         logger.info("🗑️ Удаление временных файлов...")
-        
-        for file_name in self.temp_files:
-            file_path = self.project_root / file_name
-            if file_path.exists():
-                try:
-                    file_path.unlink()
-                    self.removed_files.append(file_path)
-                    logger.info(f"✅ Удален временный файл: {file_name}")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка при удалении {file_name}: {e}")
+        self._log_sweep(self.temp_files, "✅ Удален временный файл")
     
     def clean_duplicate_code_in_file(self, file_path: Path) -> bool:
         """Очищает дублированный код в файле"""
-        try:
-            content = file_path.read_text(encoding='utf-8')
-            original_content = content
-            
-            # Удаляем дублированные импорты
-            lines = content.split('\n')
-            seen_imports = set()
-            cleaned_lines = []
-            
-            for line in lines:
-                stripped = line.strip()
-                
-                # Проверяем импорты
-                if stripped.startswith(('import ', 'from ')):
-                    if stripped not in seen_imports:
-                        seen_imports.add(stripped)
-                        cleaned_lines.append(line)
-                    else:
-                        logger.debug(f"Удален дублированный импорт: {stripped}")
-                else:
-                    cleaned_lines.append(line)
-            
-            content = '\n'.join(cleaned_lines)
-            
-            # Удаляем дублированные определения классов и функций
-            content = self._remove_duplicate_definitions(content)
-            
-            # Удаляем лишние пустые строки
-            content = re.sub(r'\n\s*\n\s*\n', '\n\n', content)
-            
-            if content != original_content:
-                file_path.write_text(content, encoding='utf-8')
-                return True
-                
-        except Exception as e:
-            logger.error(f"Ошибка при очистке {file_path}: {e}")
-            
-        return False
-    
-    def _remove_duplicate_definitions(self, content: str) -> str:
-        """Удаляет дублированные определения классов и функций"""
-        try:
-            tree = ast.parse(content)
-            seen_definitions = set()
-            lines = content.split('\n')
-            lines_to_remove = set()
-            
-            for node in ast.walk(tree):
-                if isinstance(node, (ast.ClassDef, ast.FunctionDef)):
-                    definition_key = f"{type(node).__name__}:{node.name}"
-                    
-                    if definition_key in seen_definitions:
-                        # Помечаем строки для удаления
-                        start_line = node.lineno - 1
-                        end_line = node.end_lineno if hasattr(node, 'end_lineno') else start_line + 1
-                        
-                        for i in range(start_line, min(end_line, len(lines))):
-                            lines_to_remove.add(i)
-                            
-                        logger.info(f"Найдено дублирование: {definition_key} на строке {node.lineno}")
-                    else:
-                        seen_definitions.add(definition_key)
-            
-            # Удаляем помеченные строки
-            if lines_to_remove:
-                cleaned_lines = [line for i, line in enumerate(lines) if i not in lines_to_remove]
-                return '\n'.join(cleaned_lines)
-                
-        except SyntaxError:
-            logger.warning(f"Не удалось парсить файл для удаления дублей")
-        except Exception as e:
-            logger.error(f"Ошибка при удалении дублированных определений: {e}")
-            
-        return content
+        return _clean_file(file_path)
     
     def clean_python_files(self) -> None:
         """Очищает Python файлы от дублированного кода"""
         logger.info("🐍 Очистка Python файлов от дублей...")
         
-        python_files = list(self.project_root.rglob("*.py"))
+        py_files = []
+        for root, dirs, files in os.walk(self.project_root):
+            # Скрытые каталоги (.venv, .git) отсекаем до спуска в них
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            py_files.extend(
+                os.path.join(root, file_name)
+                for file_name in files
+                if file_name.endswith('.py') and not file_name.startswith('.')
+            )
         
-        for py_file in python_files:
-            # Пропускаем файлы в .venv и .git
-            if any(part.startswith('.') for part in py_file.parts):
-                continue
-                
-            if self.clean_duplicate_code_in_file(py_file):
-                self.cleaned_files.append(py_file)
-                logger.info(f"✅ Очищен: {py_file.name}")
+        cache_dir = self.project_root / AST_CACHE_DIR
+        cache_dir.mkdir(exist_ok=True)
+        
+        # Файлы независимы, разбор AST упирается в CPU — раздаём по процессам
+        with ProcessPoolExecutor() as executor:
+            results = executor.map(_clean_one, py_files, repeat(str(cache_dir)), chunksize=32)
+            for path_str, changed in results:
+                if changed:
+                    py_file = Path(path_str)
+                    self.cleaned_files.append(py_file)
+                    logger.info(f"✅ Очищен: {py_file.name}")
+        
+        _evict_cache(cache_dir)
     
     def remove_unused_imports(self) -> None:
         """Удаляет неиспользуемые импорты из Python файлов"""
@@ -225,57 +356,45 @@ class ProjectCleanupSystem:
             "ui.py",
         ]
         
+        # Без предварительного exists(): отсутствие файла видно по ошибке чтения
         for file_name in python_files:
-            file_path = self.project_root / file_name
-            if file_path.exists():
-                self._remove_unused_imports_from_file(file_path)
+            self._remove_unused_imports_from_file(self.project_root / file_name)
     
     def _remove_unused_imports_from_file(self, file_path: Path) -> None:
         """Удаляет неиспользуемые импорты из конкретного файла"""
         try:
             content = file_path.read_text(encoding='utf-8')
-            lines = content.split('\n')
-            
-            # Простая эвристика для определения неиспользуемых импортов
-            import_lines = []
-            code_lines = []
-            
-            for i, line in enumerate(lines):
-                if line.strip().startswith(('import ', 'from ')):
-                    import_lines.append((i, line))
-                else:
-                    code_lines.append(line)
-            
-            code_content = '\n'.join(code_lines)
-            used_imports = []
-            
-            for line_num, import_line in import_lines:
-                # Извлекаем имена импортов
-                if import_line.strip().startswith('import '):
-                    module_name = import_line.replace('import ', '').split(' as ')[0].strip()
-                    if module_name in code_content:
-                        used_imports.append((line_num, import_line))
-                elif import_line.strip().startswith('from '):
-                    # Для from imports проверяем более детально
-                    used_imports.append((line_num, import_line))  # Пока оставляем все from imports
+            tree = ast.parse(content)
             
-            # Создаем новый контент
-            new_lines = [''] * len(lines)
-            for line_num, import_line in used_imports:
-                new_lines[line_num] = import_line
+            # Имена, к которым обращается код; корень цепочки атрибутов (os.path) — тоже Name
+            used_names = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)}
             
-            for i, line in enumerate(lines):
-                if not line.strip().startswith(('import ', 'from ')):
-                    new_lines[i] = line
+            lines = content.split('\n')
+            lines_to_remove = set()
             
-            # Удаляем пустые строки от удаленных импортов
-            final_lines = [line for line in new_lines if line is not None]
+            # Только импорты верхнего уровня: из try/if-блока строку не вырезать
+            for node in tree.body:
+                if isinstance(node, ast.ImportFrom) and node.module == '__future__':
+                    continue
+                if not isinstance(node, (ast.Import, ast.ImportFrom)) or node.lineno != node.end_lineno:
+                    continue
+                if any(alias.name == '*' for alias in node.names):
+                    continue
+                # Строка должна состоять из одного импорта (без "; ..." и т.п.)
+                if lines[node.lineno - 1].strip() != ast.get_source_segment(content, node):
+                    continue
+                
+                bound_names = [alias.asname or alias.name.split('.')[0] for alias in node.names]
+                if not any(name in used_names for name in bound_names):
+                    lines_to_remove.add(node.lineno - 1)
             
-            new_content = '\n'.join(final_lines)
-            if new_content != content:
+            if lines_to_remove:
+                new_content = '\n'.join(line for i, line in enumerate(lines) if i not in lines_to_remove)
                 file_path.write_text(new_content, encoding='utf-8')
                 logger.info(f"✅ Удалены неиспользуемые импорты: {file_path.name}")
                 
+        except FileNotFoundError:
+            logger.debug(f"ℹ️ Файл не найден: {file_path.name}")
         except Exception as e:
             logger.error(f"Ошибка при удалении импортов из {file_path}: {e}")
     
@@ -283,28 +402,27 @@ class ProjectCleanupSystem:
         """Создает отчет о новой структуре проекта"""
         logger.info("📊 Создание отчета о структуре проекта...")
         
-        report = """# 📁 СТРУКТУРА ПРОЕКТА ПОСЛЕ ОЧИСТКИ
+        # Части собираются в список и склеиваются один раз
+        parts = ["""# 📁 СТРУКТУРА ПРОЕКТА ПОСЛЕ ОЧИСТКИ
 
 ## 🎯 Результаты очистки
 
 ### ✅ Удаленные файлы
-"""
+"""]
         
         if self.removed_files:
-            for file_path in self.removed_files:
-                report += f"- ❌ {file_path.name}\n"
+            parts.extend(f"- ❌ {file_path.name}\n" for file_path in self.removed_files)
         else:
-            report += "- Нет удаленных файлов\n"
+            parts.append("- Нет удаленных файлов\n")
         
-        report += "\n### 🧹 Очищенные файлы\n"
+        parts.append("\n### 🧹 Очищенные файлы\n")
         
         if self.cleaned_files:
-            for file_path in self.cleaned_files:
-                report += f"- ✅ {file_path.name}\n"
+            parts.extend(f"- ✅ {file_path.name}\n" for file_path in self.cleaned_files)
         else:
-            report += "- Нет очищенных файлов\n"
+            parts.append("- Нет очищенных файлов\n")
         
-        report += f"""
+        parts.append(f"""
 
 ## 📈 Статистика
 - **Удалено файлов:** {len(self.removed_files)}
@@ -336,7 +454,8 @@ project/
 
 ---
 *Отчет сгенерирован системой очистки проекта*
-"""
+""")
+        report = "".join(parts)
         
         report_path = self.project_root / "PROJECT_CLEANUP_REPORT.md"
         report_path.write_text(report, encoding='utf-8')
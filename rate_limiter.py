@@ -1,56 +1,132 @@
 """
 Simple rate limiting middleware for FastAPI
 """
+import threading
 import time
-from collections import defaultdict, deque
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
 from fastapi import HTTPException, Request
 from fastapi.responses import JSONResponse
 import asyncio
 
+# Стартовый размер кольцевого буфера IP: разовые клиенты (ротация IP)
+# не платят за буфер на весь часовой лимит
+_INITIAL_BUFFER = 8
+
+# Примерные накладные расходы записи IP сверх данных буфера: заголовок
+# ndarray, список состояния, строка IP и узел OrderedDict
+_ENTRY_OVERHEAD = 400
+
 class RateLimiter:
-    def __init__(self, requests_per_minute: int = 60, requests_per_hour: int = 1000):
+    def __init__(
+        self,
+        requests_per_minute: int = 60,
+        requests_per_hour: int = 1000,
+        num_shards: int = 16,
+        max_memory_bytes: int = 64 * 1024 * 1024,
+    ):
         self.requests_per_minute = requests_per_minute
         self.requests_per_hour = requests_per_hour
 
-        # Хранилище запросов по IP
-        self.minute_requests = defaultdict(deque)
-        self.hour_requests = defaultdict(deque)
-
-    def is_allowed(self, client_ip: str) -> tuple[bool, str]:
-        """Проверяет, разрешен ли запрос от данного IP"""
-        current_time = time.time()
-
-        # Очищаем старые записи
-        self._cleanup_old_requests(client_ip, current_time)
-
-        # Проверяем лимиты
-        minute_count = len(self.minute_requests[client_ip])
-        hour_count = len(self.hour_requests[client_ip])
-
-        if minute_count >= self.requests_per_minute:
-            return False, f"Rate limit exceeded: {minute_count}/{self.requests_per_minute} requests per minute"
-
-        if hour_count >= self.requests_per_hour:
-            return False, f"Rate limit exceeded: {hour_count}/{self.requests_per_hour} requests per hour"
-
-        # Добавляем текущий запрос
-        self.minute_requests[client_ip].append(current_time)
-        self.hour_requests[client_ip].append(current_time)
-
-        return True, "OK"
-
-    def _cleanup_old_requests(self, client_ip: str, current_time: float):
-        """Удаляет старые записи запросов"""
-        minute_ago = current_time - 60
-        hour_ago = current_time - 3600
-
-        # Очищаем минутные запросы
-        while self.minute_requests[client_ip] and self.minute_requests[client_ip][0] < minute_ago:
-            self.minute_requests[client_ip].popleft()
-
-        # Очищаем часовые запросы
-        while self.hour_requests[client_ip] and self.hour_requests[client_ip][0] < hour_ago:
-            self.hour_requests[client_ip].popleft()
+        # Кольцевой буфер меток времени на IP: [массив, head, size].
+        # Буфер удваивается по мере накопления запросов до _capacity.
+        # В окне часа принятых запросов не больше requests_per_hour, поэтому
+        # при заполнении полного буфера перезаписывается только уже истёкшая метка
+        self._capacity = max(requests_per_hour, requests_per_minute)
+
+        # Строковые значения лимитов для заголовков ответа
+        self.minute_limit_header = str(requests_per_minute)
+        self.hour_limit_header = str(requests_per_hour)
+
+        # IP распределены по шардам, у каждого свой замок: проверка и запись
+        # атомарны, а запросы с разных IP почти не ждут друг друга
+        self._shards: list[OrderedDict[str, list]] = [OrderedDict() for _ in range(num_shards)]
+        self._locks = [threading.Lock() for _ in range(num_shards)]
+
+        # Шард — LRU по времени последнего запроса: когда суммарный размер
+        # записей шарда превышает его долю max_memory_bytes, давно молчащие IP
+        # вытесняются. Худший случай — около max_memory_bytes на процесс
+        # (у каждого воркера свой лимитер): с настройками по умолчанию это
+        # ~145 тыс. разовых IP или ~8 тыс. IP с полным часовым буфером
+        self._max_shard_bytes = max(1, max_memory_bytes // num_shards)
+        self._shard_bytes = [0] * num_shards
+
+    def _shard_index(self, client_ip: str) -> int:
+        return hash(client_ip) % len(self._shards)
+
+    def _counts(self, state: Optional[list], current_time: float) -> tuple[int, int]:
+        """Число меток буфера за последнюю минуту и за последний час"""
+        if state is None:
+            return 0, 0
+
+        buf, head, size = state
+        # Метки растут по кругу: старшая половина начинается с head
+        segments = (buf[:size],) if size < len(buf) else (buf[head:], buf[:head])
+        thresholds = np.array([current_time - 60, current_time - 3600])
+
+        minute_count = hour_count = 0
+        for segment in segments:
+            # Бинарный поиск первой неистёкшей метки сразу для обоих окон
+            expired = np.searchsorted(segment, thresholds)
+            minute_count += len(segment) - int(expired[0])
+            hour_count += len(segment) - int(expired[1])
+        return minute_count, hour_count
+
+    def is_allowed(self, client_ip: str) -> tuple[bool, str, int, int]:
+        """Проверяет, разрешен ли запрос от данного IP.
+
+        Возвращает (разрешён, сообщение, запросов за минуту, запросов за час)
+        с учётом текущего запроса, если он принят.
+        """
+        index = self._shard_index(client_ip)
+        shard = self._shards[index]
+
+        with self._locks[index]:
+            # Время читается под замком: метки одного IP попадают в буфер
+            # в порядке возрастания, на что опирается searchsorted в _counts.
+            # monotonic не прыгает назад при коррекции системных часов
+            current_time = time.monotonic()
+            state = shard.get(client_ip)
+            if state is not None:
+                shard.move_to_end(client_ip)
+
+            # Проверяем лимиты
+            minute_count, hour_count = self._counts(state, current_time)
+
+            if minute_count >= self.requests_per_minute:
+                message = f"Rate limit exceeded: {minute_count}/{self.requests_per_minute} requests per minute"
+                return False, message, minute_count, hour_count
+
+            if hour_count >= self.requests_per_hour:
+                message = f"Rate limit exceeded: {hour_count}/{self.requests_per_hour} requests per hour"
+                return False, message, minute_count, hour_count
+
+            # Добавляем текущий запрос
+            if state is None:
+                initial = min(_INITIAL_BUFFER, self._capacity)
+                state = shard[client_ip] = [np.empty(initial, dtype=np.float64), 0, 0]
+                self._shard_bytes[index] += _ENTRY_OVERHEAD + state[0].nbytes
+            buf, head, size = state
+            if size == len(buf) < self._capacity:
+                # Буфер заполнен, но до лимита ещё есть место: разворачиваем
+                # кольцо по порядку в массив вдвое больше
+                grown = np.empty(min(2 * len(buf), self._capacity), dtype=np.float64)
+                grown[:size - head] = buf[head:]
+                grown[size - head:size] = buf[:head]
+                self._shard_bytes[index] += grown.nbytes - buf.nbytes
+                state[0] = buf = grown
+                head = size
+            buf[head] = current_time
+            state[1] = (head + 1) % len(buf)
+            state[2] = min(size + 1, len(buf))
+
+            # Текущий IP уже в конце очереди и не вытесняется
+            while self._shard_bytes[index] > self._max_shard_bytes and len(shard) > 1:
+                _, evicted = shard.popitem(last=False)
+                self._shard_bytes[index] -= _ENTRY_OVERHEAD + evicted[0].nbytes
+
+        return True, "OK", minute_count + 1, hour_count + 1
 
 # Глобальный rate limiter
 rate_limiter = RateLimiter()
@@ -69,7 +145,7 @@ async def rate_limit_middleware(request: Request, call_next):
         return response
 
     # Проверяем rate limit
-    allowed, message = rate_limiter.is_allowed(client_ip)
+    allowed, message, minute_count, hour_count = rate_limiter.is_allowed(client_ip)
 
     if not allowed:
         return JSONResponse(
@@ -82,12 +158,12 @@ async def rate_limit_middleware(request: Request, call_next):
     response = await call_next(request)
 
     # Добавляем заголовки с информацией о лимитах
-    remaining_minute = rate_limiter.requests_per_minute - len(rate_limiter.minute_requests[client_ip])
-    remaining_hour = rate_limiter.requests_per_hour - len(rate_limiter.hour_requests[client_ip])
+    remaining_minute = rate_limiter.requests_per_minute - minute_count
+    remaining_hour = rate_limiter.requests_per_hour - hour_count
 
-    response.headers["X-RateLimit-Limit-Minute"] = str(rate_limiter.requests_per_minute)
+    response.headers["X-RateLimit-Limit-Minute"] = rate_limiter.minute_limit_header
     response.headers["X-RateLimit-Remaining-Minute"] = str(max(0, remaining_minute))
-    response.headers["X-RateLimit-Limit-Hour"] = str(rate_limiter.requests_per_hour)
+    response.headers["X-RateLimit-Limit-Hour"] = rate_limiter.hour_limit_header
     response.headers["X-RateLimit-Remaining-Hour"] = str(max(0, remaining_hour))
 
     return response
@@ -3,13 +3,13 @@
 Test Decision Capsule: 20 задач для проверки ужатого контракта
 """
 
-import os
-import json
 import random
 from datetime import datetime
 from collections import defaultdict
+import numpy as np
 from agent_system.active_director import ActiveDirector
 from agent_system.director_circuit_breaker import DirectorCircuitBreaker
+from agent_system.io_utils import write_json
 
 
 # 20 разнообразных задач
@@ -36,6 +36,14 @@ TEST_TASKS = [
     {"task": "Add API key rotation", "domains": ["security", "architect"], "risk": "high"},
 ]
 
+# Заготовки для create_consilium_result, не зависящие от конкретной задачи
+_BASE_CONFIDENCE = {"low": 0.85, "medium": 0.75, "high": 0.65}
+_ROLES = {domain: f"{domain.title()} Specialist" for task in TEST_TASKS for domain in task["domains"]}
+_KB_CHUNKS = {"chunks_used": 2}
+
+# Общий пустой dict для отсутствующих ключей ответа (только чтение)
+_EMPTY: dict = {}
+
 
 def create_consilium_result(task_info: dict, task_id: int) -> dict:
     """Создаёт реалистичный результат consilium"""
@@ -43,16 +51,13 @@ def create_consilium_result(task_info: dict, task_id: int) -> dict:
     domains = task_info["domains"]
     risk = task_info["risk"]
     
-    base_confidence = {"low": 0.85, "medium": 0.75, "high": 0.65}[risk]
+    base_confidence = _BASE_CONFIDENCE[risk]
     confidence = base_confidence + random.uniform(-0.05, 0.05)
     confidence = max(0.5, min(0.95, confidence))
     
-    opinions = {}
-    for domain in domains:
-        opinions[domain] = {
-            "role": f"{domain.title()} Specialist",
-            "opinion": f"Analysis for: {task_info['task']}. Recommendation: implement with best practices and proper testing."
-        }
+    # Текст мнения одинаков для всех доменов задачи — формируем один раз
+    opinion = f"Analysis for: {task_info['task']}. Recommendation: implement with best practices and proper testing."
+    opinions = {domain: {"role": _ROLES[domain], "opinion": opinion} for domain in domains}
     
     return {
         "task": task_info["task"],
@@ -65,7 +70,8 @@ def create_consilium_result(task_info: dict, task_id: int) -> dict:
             "domains_matched": len(domains),
         },
         "timing": {"agents_parallel": 10.0, "total": 12.0},
-        "kb_retrieval": {"per_agent": {d: {"chunks_used": 2} for d in domains}}
+        # Общий вложенный dict безопасен: результат KB только читается
+        "kb_retrieval": {"per_agent": dict.fromkeys(domains, _KB_CHUNKS)}
     }
 
 
@@ -87,8 +93,10 @@ def main():
         "overrides": 0,
         "tokens_total": 0,
         "cost_total": 0.0,
-        "latencies": []
     }
+    # Задержки вызовов директора: заранее выделенный массив, заполняются первые n
+    latencies = np.zeros(len(TEST_TASKS))
+    n_latencies = 0
     
     for i, task_info in enumerate(TEST_TASKS, 1):
         print(f"\n[{i}/20] {task_info['task'][:45]}...")
@@ -98,12 +106,12 @@ def main():
         
         stats["total"] += 1
         
-        active_info = result.get("active_director", {})
+        active_info = result.get("active_director") or _EMPTY
         
         if active_info.get("active_director_used"):
             stats["director_calls"] += 1
             
-            metrics = active_info.get("metrics", {})
+            metrics = active_info.get("metrics") or _EMPTY
             tokens = metrics.get("total_tokens", 0)
             cost = metrics.get("total_cost", 0)
             
@@ -117,9 +125,10 @@ def main():
             stats["tokens_total"] = tokens
             stats["cost_total"] = cost
             
-            timing = active_info.get("timing", {})
-            if timing.get("director_call"):
-                stats["latencies"].append(timing["director_call"])
+            director_call = (active_info.get("timing") or _EMPTY).get("director_call")
+            if director_call:
+                latencies[n_latencies] = director_call
+                n_latencies += 1
             
             if active_info.get("override_applied"):
                 stats["overrides"] += 1
@@ -128,10 +137,10 @@ def main():
                 print(f"   📝 Review only")
             
             # Показываем размер запроса
-            request = active_info.get("director_request", {})
+            request = active_info.get("director_request") or _EMPTY
             summary_len = len(request.get("problem_summary", ""))
             facts_count = len(request.get("facts", []))
-            agents_len = sum(len(v) for v in request.get("agent_summaries", {}).values())
+            agents_len = sum(len(v) for v in (request.get("agent_summaries") or _EMPTY).values())
             print(f"   📦 Capsule: summary={summary_len}ch, facts={facts_count}, agents={agents_len}ch")
         else:
             print(f"   ⏭️ Skipped")
@@ -143,7 +152,7 @@ def main():
     
     avg_tokens = stats["tokens_total"] / max(stats["director_calls"], 1)
     avg_cost = stats["cost_total"] / max(stats["director_calls"], 1)
-    avg_latency = sum(stats["latencies"]) / max(len(stats["latencies"]), 1)
+    avg_latency = float(latencies[:n_latencies].mean()) if n_latencies else 0.0
     override_rate = stats["overrides"] / max(stats["director_calls"], 1)
     
     print(f"\n📊 KEY METRICS:")
@@ -179,9 +188,7 @@ def main():
         }
     }
     
-    os.makedirs("reports", exist_ok=True)
-    with open("reports/capsule_test_20.json", "w") as f:
-        json.dump(summary, f, indent=2)
+    write_json("reports/capsule_test_20.json", summary)
     
     print(f"\n✅ Report saved to reports/capsule_test_20.json")
 
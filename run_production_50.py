@@ -4,125 +4,351 @@ Production Run: 50 задач с Active Director и Circuit Breaker
 Генерирует агрегированный отчёт в reports/director_day1_summary.json
 """
 
+import asyncio
+import logging
 import os
-import json
-import random
+import sys
+import time
+import numpy as np
 from datetime import datetime
-from collections import defaultdict
+from collections import Counter, deque
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, Tuple
 from agent_system.active_director import ActiveDirector
 from agent_system.director_circuit_breaker import circuit_breaker
+from agent_system.io_utils import write_json
+
+try:
+    from numba import njit
+
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+logger = logging.getLogger("run_production_50")
+
+# Полные traceback'и упавших задач
+ERROR_LOG_PATH = "reports/production_errors.log"
+
+# Сколько задач одновременно ждут ответа Director на старте (дальше — AIMD)
+SHADOW_CONCURRENCY = int(os.getenv("SHADOW_CONCURRENCY", "10"))
+
+
+@dataclass(frozen=True)
+class Task:
+    """Задача каталога: формулировка, домены и уровень риска"""
+    __slots__ = ("task", "domains", "risk")
+    
+    task: str
+    domains: Tuple[str, ...]
+    risk: str
+
+
+# Домены каталога известны заранее; индекс — позиция в массивах счётчиков
+ALL_DOMAINS = ("security", "architect", "dev", "qa", "ux", "seo")
+DOMAIN_IDX = {domain: idx for idx, domain in enumerate(ALL_DOMAINS)}
+
+# Справочники create_consilium_result, посчитанные один раз
+_BASE_CONFIDENCE = {"low": 0.85, "medium": 0.75, "high": 0.65}
+_ROLES = {domain: f"{domain.title()} Specialist" for domain in ALL_DOMAINS}
 
 
 # 50 реалистичных задач разных доменов
-PRODUCTION_TASKS = [
+PRODUCTION_TASKS: Tuple[Task, ...] = (
     # Security (10 задач)
-    {"task": "Implement JWT authentication with refresh tokens", "domains": ["security", "dev"], "risk": "high"},
-    {"task": "Add CSRF protection to all forms", "domains": ["security", "dev"], "risk": "high"},
-    {"task": "Implement rate limiting for login endpoint", "domains": ["security", "dev"], "risk": "high"},
-    {"task": "Add input validation for user registration", "domains": ["security", "dev"], "risk": "high"},
-    {"task": "Implement password hashing with bcrypt", "domains": ["security", "dev"], "risk": "high"},
-    {"task": "Add SQL injection protection", "domains": ["security", "dev"], "risk": "high"},
-    {"task": "Implement XSS sanitization", "domains": ["security", "dev"], "risk": "high"},
-    {"task": "Add API key rotation mechanism", "domains": ["security", "architect"], "risk": "high"},
-    {"task": "Implement audit logging for sensitive operations", "domains": ["security", "dev"], "risk": "high"},
-    {"task": "Add two-factor authentication", "domains": ["security", "dev", "ux"], "risk": "high"},
+    Task("Implement JWT authentication with refresh tokens", ("security", "dev"), "high"),
+    Task("Add CSRF protection to all forms", ("security", "dev"), "high"),
+    Task("Implement rate limiting for login endpoint", ("security", "dev"), "high"),
+    Task("Add input validation for user registration", ("security", "dev"), "high"),
+    Task("Implement password hashing with bcrypt", ("security", "dev"), "high"),
+    Task("Add SQL injection protection", ("security", "dev"), "high"),
+    Task("Implement XSS sanitization", ("security", "dev"), "high"),
+    Task("Add API key rotation mechanism", ("security", "architect"), "high"),
+    Task("Implement audit logging for sensitive operations", ("security", "dev"), "high"),
+    Task("Add two-factor authentication", ("security", "dev", "ux"), "high"),
     
     # Architecture (8 задач)
-    {"task": "Design microservices communication pattern", "domains": ["architect", "dev"], "risk": "medium"},
-    {"task": "Create database migration for user roles", "domains": ["architect", "dev", "security"], "risk": "high"},
-    {"task": "Design caching strategy for API responses", "domains": ["architect", "dev"], "risk": "medium"},
-    {"task": "Plan horizontal scaling architecture", "domains": ["architect"], "risk": "medium"},
-    {"task": "Design event-driven notification system", "domains": ["architect", "dev"], "risk": "medium"},
-    {"task": "Create data backup and recovery plan", "domains": ["architect", "security"], "risk": "high"},
-    {"task": "Design API versioning strategy", "domains": ["architect", "dev"], "risk": "medium"},
-    {"task": "Plan database sharding approach", "domains": ["architect", "dev"], "risk": "high"},
+    Task("Design microservices communication pattern", ("architect", "dev"), "medium"),
+    Task("Create database migration for user roles", ("architect", "dev", "security"), "high"),
+    Task("Design caching strategy for API responses", ("architect", "dev"), "medium"),
+    Task("Plan horizontal scaling architecture", ("architect",), "medium"),
+    Task("Design event-driven notification system", ("architect", "dev"), "medium"),
+    Task("Create data backup and recovery plan", ("architect", "security"), "high"),
+    Task("Design API versioning strategy", ("architect", "dev"), "medium"),
+    Task("Plan database sharding approach", ("architect", "dev"), "high"),
     
     # Dev (15 задач)
-    {"task": "Implement user profile CRUD operations", "domains": ["dev"], "risk": "low"},
-    {"task": "Add pagination to list endpoints", "domains": ["dev"], "risk": "low"},
-    {"task": "Implement file upload functionality", "domains": ["dev", "security"], "risk": "medium"},
-    {"task": "Create email notification service", "domains": ["dev"], "risk": "low"},
-    {"task": "Add search functionality with filters", "domains": ["dev"], "risk": "low"},
-    {"task": "Implement webhook handlers", "domains": ["dev", "security"], "risk": "medium"},
-    {"task": "Create data export to CSV/Excel", "domains": ["dev"], "risk": "low"},
-    {"task": "Add real-time updates with WebSocket", "domains": ["dev", "architect"], "risk": "medium"},
-    {"task": "Implement batch processing for reports", "domains": ["dev"], "risk": "low"},
-    {"task": "Create admin dashboard API", "domains": ["dev", "security"], "risk": "medium"},
-    {"task": "Add logging and monitoring endpoints", "domains": ["dev"], "risk": "low"},
-    {"task": "Implement data import from external API", "domains": ["dev"], "risk": "low"},
-    {"task": "Create scheduled task runner", "domains": ["dev"], "risk": "low"},
-    {"task": "Add configuration management", "domains": ["dev"], "risk": "low"},
-    {"task": "Implement feature flags system", "domains": ["dev", "architect"], "risk": "medium"},
+    Task("Implement user profile CRUD operations", ("dev",), "low"),
+    Task("Add pagination to list endpoints", ("dev",), "low"),
+    Task("Implement file upload functionality", ("dev", "security"), "medium"),
+    Task("Create email notification service", ("dev",), "low"),
+    Task("Add search functionality with filters", ("dev",), "low"),
+    Task("Implement webhook handlers", ("dev", "security"), "medium"),
+    Task("Create data export to CSV/Excel", ("dev",), "low"),
+    Task("Add real-time updates with WebSocket", ("dev", "architect"), "medium"),
+    Task("Implement batch processing for reports", ("dev",), "low"),
+    Task("Create admin dashboard API", ("dev", "security"), "medium"),
+    Task("Add logging and monitoring endpoints", ("dev",), "low"),
+    Task("Implement data import from external API", ("dev",), "low"),
+    Task("Create scheduled task runner", ("dev",), "low"),
+    Task("Add configuration management", ("dev",), "low"),
+    Task("Implement feature flags system", ("dev", "architect"), "medium"),
     
     # QA (8 задач)
-    {"task": "Write unit tests for user service", "domains": ["qa", "dev"], "risk": "low"},
-    {"task": "Create integration tests for API", "domains": ["qa", "dev"], "risk": "low"},
-    {"task": "Add end-to-end tests for checkout flow", "domains": ["qa", "dev"], "risk": "low"},
-    {"task": "Implement load testing suite", "domains": ["qa", "architect"], "risk": "medium"},
-    {"task": "Create test data generators", "domains": ["qa", "dev"], "risk": "low"},
-    {"task": "Add code coverage reporting", "domains": ["qa", "dev"], "risk": "low"},
-    {"task": "Implement smoke tests for deployment", "domains": ["qa", "dev"], "risk": "low"},
-    {"task": "Create regression test suite", "domains": ["qa", "dev"], "risk": "low"},
+    Task("Write unit tests for user service", ("qa", "dev"), "low"),
+    Task("Create integration tests for API", ("qa", "dev"), "low"),
+    Task("Add end-to-end tests for checkout flow", ("qa", "dev"), "low"),
+    Task("Implement load testing suite", ("qa", "architect"), "medium"),
+    Task("Create test data generators", ("qa", "dev"), "low"),
+    Task("Add code coverage reporting", ("qa", "dev"), "low"),
+    Task("Implement smoke tests for deployment", ("qa", "dev"), "low"),
+    Task("Create regression test suite", ("qa", "dev"), "low"),
     
     # UX (5 задач)
-    {"task": "Fix button alignment on mobile", "domains": ["ux", "dev"], "risk": "low"},
-    {"task": "Improve form validation UX", "domains": ["ux", "dev"], "risk": "low"},
-    {"task": "Add loading states to async operations", "domains": ["ux", "dev"], "risk": "low"},
-    {"task": "Create user onboarding flow", "domains": ["ux", "dev", "qa"], "risk": "medium"},
-    {"task": "Improve error messages clarity", "domains": ["ux", "dev"], "risk": "low"},
+    Task("Fix button alignment on mobile", ("ux", "dev"), "low"),
+    Task("Improve form validation UX", ("ux", "dev"), "low"),
+    Task("Add loading states to async operations", ("ux", "dev"), "low"),
+    Task("Create user onboarding flow", ("ux", "dev", "qa"), "medium"),
+    Task("Improve error messages clarity", ("ux", "dev"), "low"),
     
     # SEO (4 задачи)
-    {"task": "Add meta tags for SEO", "domains": ["seo", "dev"], "risk": "low"},
-    {"task": "Create sitemap generator", "domains": ["seo", "dev"], "risk": "low"},
-    {"task": "Implement structured data markup", "domains": ["seo", "dev"], "risk": "low"},
-    {"task": "Add canonical URLs", "domains": ["seo", "dev"], "risk": "low"},
-]
+    Task("Add meta tags for SEO", ("seo", "dev"), "low"),
+    Task("Create sitemap generator", ("seo", "dev"), "low"),
+    Task("Implement structured data markup", ("seo", "dev"), "low"),
+    Task("Add canonical URLs", ("seo", "dev"), "low"),
+)
+
+# Максимум доменов у одной задачи — ширина матрицы индексов доменов
+_MAX_TASK_DOMAINS = max(len(task.domains) for task in PRODUCTION_TASKS)
+
+
+@lru_cache(maxsize=None)
+def _domain_skeleton(domains: Tuple[str, ...]) -> tuple:
+    """
+    Части результата consilium, зависящие только от набора доменов
+    
+    Возвращает (triggers_matched, reason, per_agent). Наборов доменов
+    в каталоге около 15, поэтому словари строятся один раз на набор
+    и разделяются между результатами (director их только читает).
+    """
+    triggers_matched = {d: ["task_trigger"] for d in domains}
+    reason = f"Task involves {', '.join(domains)}"
+    per_agent = {d: {"chunks_used": 2, "chars_used": 800} for d in domains}
+    return triggers_matched, reason, per_agent
 
 
-def create_consilium_result(task_info: dict, task_id: int) -> dict:
-    """Создаёт реалистичный результат consilium"""
+def create_consilium_result(task_info: Task, task_id: int, noise) -> dict:
+    """Создаёт реалистичный результат consilium
     
-    domains = task_info["domains"]
-    risk = task_info["risk"]
+    noise — заранее выбранная тройка случайных сдвигов задачи:
+    (confidence, agents_parallel, total).
+    """
+    
+    domains = task_info.domains
     
     # Confidence зависит от риска и количества доменов
-    base_confidence = {"low": 0.85, "medium": 0.75, "high": 0.65}[risk]
-    confidence = base_confidence + random.uniform(-0.05, 0.05)
+    base_confidence = _BASE_CONFIDENCE[task_info.risk]
+    confidence_noise, parallel_noise, total_noise = noise
+    confidence = base_confidence + float(confidence_noise)
     confidence = max(0.5, min(0.95, confidence))
     
-    opinions = {}
-    for domain in domains:
-        opinions[domain] = {
-            "role": f"{domain.title()} Specialist",
-            "opinion": f"Analysis for task: {task_info['task'][:40]}... Recommendation: proceed with standard practices."
-        }
+    # Текст мнения одинаков для всех доменов задачи — строим один раз
+    opinion = f"Analysis for task: {task_info.task[:40]}... Recommendation: proceed with standard practices."
+    opinions = {domain: {"role": _ROLES[domain], "opinion": opinion} for domain in domains}
+    
+    triggers_matched, reason, per_agent = _domain_skeleton(domains)
     
     return {
-        "task": task_info["task"],
+        "task": task_info.task,
         "mode": "STANDARD" if len(domains) > 1 else "FAST",
         "opinions": opinions,
         "director_decision": None,
-        "recommendation": f"Consilium recommendation for: {task_info['task'][:30]}...",
+        "recommendation": f"Consilium recommendation for: {task_info.task[:30]}...",
         "routing": {
             "smart_routing": True,
             "confidence": round(confidence, 2),
             "domains_matched": len(domains),
-            "triggers_matched": {d: ["task_trigger"] for d in domains},
+            "triggers_matched": triggers_matched,
             "downgraded": False,
-            "reason": f"Task involves {', '.join(domains)}"
+            "reason": reason
         },
         "timing": {
-            "agents_parallel": 8.0 + random.uniform(0, 4),
+            "agents_parallel": 8.0 + float(parallel_noise),
             "director": 0.0,
-            "total": 10.0 + random.uniform(0, 5)
+            "total": 10.0 + float(total_noise)
         },
         "kb_retrieval": {
             "config": {"top_k": 3, "max_chars": 6000},
-            "per_agent": {d: {"chunks_used": 2, "chars_used": 800} for d in domains}
+            "per_agent": per_agent
         }
     }
 
 
+def _reduce_stats(tokens, costs, called, overridden, domain_idx, num_domains):
+    """
+    Числовая агрегация прогона одним проходом
+    
+    Возвращает (токены, стоимость, счётчики доменов [tasks, director_calls,
+    overrides] x num_domains). Строки domain_idx дополнены -1.
+    При наличии numba функция компилируется (см. ниже).
+    """
+    tokens_total = 0
+    cost_total = 0.0
+    domain_counts = np.zeros((3, num_domains), np.int64)
+    
+    for i in range(tokens.shape[0]):
+        for j in range(domain_idx.shape[1]):
+            idx = domain_idx[i, j]
+            if idx < 0:
+                break
+            domain_counts[0, idx] += 1
+            if called[i]:
+                domain_counts[1, idx] += 1
+            if overridden[i]:
+                domain_counts[2, idx] += 1
+        
+        if called[i]:
+            tokens_total += tokens[i]
+            cost_total += costs[i]
+    
+    return tokens_total, cost_total, domain_counts
+
+
+if NUMBA_AVAILABLE:
+    # На 50 задачах компиляция не окупается, но cache=True сохраняет её
+    # между запусками, а при тысячах задач ядро становится узким местом
+    _reduce_stats = njit(cache=True)(_reduce_stats)
+
+
+class AIMDController:
+    """
+    Адаптивный лимит одновременных вызовов Director (AIMD) с предохранителем
+    
+    Ответ быстрее target_latency поднимает лимит на alpha, ошибка или
+    медленный ответ умножает его на beta (в пределах [c_min, c_max]).
+    Если в полном окне последних window исходов доля ошибок >= error_threshold,
+    предохранитель размыкается на cooldown секунд: задачи сразу получают отказ
+    вместо ожидания таймаута.
+    
+    Создаётся внутри работающего event loop (asyncio.Condition в Python 3.9
+    привязывается к текущему циклу).
+    """
+    
+    def __init__(self, initial: int = 10, target_latency: float = 5.0, alpha: float = 1.0,
+                 beta: float = 0.5, c_min: int = 1, c_max: int = 20, window: int = 20,
+                 error_threshold: float = 0.5, cooldown: float = 30.0):
+        self.target_latency = target_latency
+        self.alpha = alpha
+        self.beta = beta
+        self.c_min = c_min
+        self.c_max = c_max
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        
+        self.limit = float(min(max(initial, c_min), c_max))
+        self.in_flight = 0
+        self._outcomes: deque = deque(maxlen=window)  # True — ошибка
+        self._open_until = 0.0
+        self._condition = asyncio.Condition()
+    
+    @property
+    def is_open(self) -> bool:
+        """Разомкнут ли предохранитель"""
+        return time.monotonic() < self._open_until
+    
+    async def acquire(self) -> bool:
+        """Ждёт свободный слот; False — предохранитель разомкнут, вызывать Director нельзя"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.is_open or self.in_flight < int(self.limit))
+            if self.is_open:
+                return False
+            self.in_flight += 1
+            return True
+    
+    async def release(self, latency: float, error: bool):
+        """Освобождает слот и подстраивает лимит по исходу вызова"""
+        async with self._condition:
+            self.in_flight -= 1
+            self._outcomes.append(error)
+            
+            if error or latency > self.target_latency:
+                self.limit = max(self.c_min, self.limit * self.beta)
+            else:
+                self.limit = min(self.c_max, self.limit + self.alpha)
+            
+            window_full = len(self._outcomes) == self._outcomes.maxlen
+            if window_full and sum(self._outcomes) / len(self._outcomes) >= self.error_threshold:
+                self._open_until = time.monotonic() + self.cooldown
+                self._outcomes.clear()
+                print(f"   🔌 Director breaker open for {self.cooldown:.0f}s")
+            
+            self._condition.notify_all()
+
+
+# Результат задачи, отклонённой разомкнутым предохранителем
+_BREAKER_OPEN_RESULT = {"active_director": {"active_director_used": False, "reason": "breaker_open"}}
+
+
+def _director_error(result: dict) -> Optional[str]:
+    """
+    Текст ошибки Director из результата задачи
+    
+    ActiveDirector.run_active_analysis сам ловит исключения и возвращает
+    результат с active_director["error"], поэтому сбой API не всплывает
+    исключением и проверяется по результату.
+    """
+    return result.get("active_director", {}).get("error")
+
+
+async def _run_tasks_concurrently(active_director: ActiveDirector, tasks: list, noise: np.ndarray,
+                                  mode_changes: list) -> list:
+    """
+    Прогоняет задачи через Active Director под управлением AIMDController
+    
+    Стартовый лимит одновременных вызовов — SHADOW_CONCURRENCY, дальше он
+    подстраивается по задержке и ошибкам. Возвращает результаты в порядке
+    задач; исключение задачи попадает в список вместо результата. Смены
+    режима circuit breaker фиксируются по мере завершения задач в mode_changes.
+    """
+    controller = AIMDController(initial=SHADOW_CONCURRENCY, c_max=max(20, SHADOW_CONCURRENCY))
+    last_mode = circuit_breaker.current_mode
+    
+    async def run_one(task_id: int, task_info: Task, task_noise: np.ndarray) -> dict:
+        nonlocal last_mode
+        if not await controller.acquire():
+            return _BREAKER_OPEN_RESULT
+        
+        started = time.monotonic()
+        try:
+            # Создаём consilium результат и запускаем active director
+            consilium_result = create_consilium_result(task_info, task_id, task_noise)
+            result = await active_director.run_active_analysis_async(consilium_result)
+        except Exception:
+            await controller.release(time.monotonic() - started, error=True)
+            raise
+        await controller.release(time.monotonic() - started, error=bool(_director_error(result)))
+        
+        # Проверяем mode changes (корутины выполняются в одном потоке event loop)
+        current_mode = circuit_breaker.current_mode
+        if current_mode != last_mode:
+            mode_changes.append({
+                "task_id": task_id,
+                "from": last_mode,
+                "to": current_mode,
+                "reason": "circuit_breaker_triggered"
+            })
+            last_mode = current_mode
+            print(f"   ⚠️ MODE CHANGE: {mode_changes[-1]}")
+        
+        return result
+    
+    return await asyncio.gather(
+        *(run_one(i, task_info, task_noise) for i, (task_info, task_noise) in enumerate(zip(tasks, noise), 1)),
+        return_exceptions=True
+    )
+
+
 def run_production_50():
     """Запускает 50 production задач"""
     
@@ -145,93 +371,110 @@ def run_production_50():
     # Инициализируем Active Director
     active_director = ActiveDirector(enabled=True)
     
-    # Статистика
-    stats = {
-        "total_tasks": 0,
-        "director_calls": 0,
-        "overrides_applied": 0,
-        "mode_changes": [],
-        "tokens_total": 0,
-        "cost_total": 0.0,
-        "override_reasons": defaultdict(int),
-        "domain_breakdown": defaultdict(lambda: {"tasks": 0, "director_calls": 0, "overrides": 0}),
-        "errors": 0,
-        "latencies": []
-    }
-    
     # Перемешиваем задачи для реалистичности
-    tasks = PRODUCTION_TASKS.copy()
-    random.shuffle(tasks)
+    rng = np.random.default_rng()
+    tasks = [PRODUCTION_TASKS[j] for j in rng.permutation(len(PRODUCTION_TASKS))]
+    
+    # Случайные сдвиги всех задач одним вызовом: столбцы — confidence,
+    # agents_parallel и total
+    noise = rng.uniform([-0.05, 0.0, 0.0], [0.05, 4.0, 5.0], size=(len(tasks), 3))
+    
+    print(f"Initial concurrency: {SHADOW_CONCURRENCY}")
+    
+    # Задачи идут параллельно, смены режима фиксируются по мере завершения
+    mode_changes = []
+    results = asyncio.run(_run_tasks_concurrently(active_director, tasks, noise, mode_changes))
+    
+    # Проход по порядку только собирает исходы и сырые результаты;
+    # отчёт о задачах уходит в stdout одной записью
+    progress = []
+    completed = []
+    errors = 0
+    error_types = Counter()
+    for i, (task_info, result) in enumerate(zip(tasks, results), 1):
+        progress.append(f"\n[{i}/50] {task_info.task[:50]}...")
+        
+        if isinstance(result, Exception):
+            # В stdout и отчёт — только тип ошибки; str() ответа OpenAI
+            # бывает дорогим, полный traceback уходит в ERROR_LOG_PATH
+            errors += 1
+            error_types[type(result).__name__] += 1
+            logger.error("task %d failed: %s", i, task_info.task, exc_info=result)
+            progress.append(f"   ❌ Error: {type(result).__name__}")
+            continue
+        
+        director_error = _director_error(result)
+        if director_error:
+            # Исключение уже поймано внутри ActiveDirector, traceback'а нет
+            errors += 1
+            error_types["DirectorError"] += 1
+            logger.error("task %d failed: %s: %s", i, task_info.task, director_error)
+            progress.append("   ❌ Error: DirectorError")
+            continue
+        
+        active_info = result.get("active_director", {})
+        completed.append((task_info, active_info))
+        
+        if not active_info.get("active_director_used"):
+            progress.append(f"   ⏭️ Skipped: {active_info.get('reason', 'unknown')}")
+        elif active_info.get("override_applied"):
+            progress.append(f"   ✅ Override: {active_info.get('override_reason', 'unknown')[:40]}")
+        else:
+            progress.append("   📝 Review only")
+    
+    progress.append("")
+    sys.stdout.write("\n".join(progress))
+    
+    # Сырые результаты раскладываются по плотным массивам (SoA),
+    # числовая агрегация — одним проходом ядра _reduce_stats
+    count = len(completed)
+    tokens = np.zeros(count, np.int64)
+    costs = np.zeros(count, np.float64)
+    called = np.zeros(count, np.bool_)
+    overridden = np.zeros(count, np.bool_)
+    domain_idx = np.full((count, _MAX_TASK_DOMAINS), -1, np.int8)
+    override_reasons = Counter()
+    latencies = []
+    
+    for i, (task_info, active_info) in enumerate(completed):
+        for j, domain in enumerate(task_info.domains):
+            domain_idx[i, j] = DOMAIN_IDX[domain]
+        
+        if not active_info.get("active_director_used"):
+            continue
+        called[i] = True
+        metrics = active_info.get("metrics", {})
+        tokens[i] = metrics.get("total_tokens", 0)
+        costs[i] = metrics.get("total_cost", 0)
+        
+        director_call = active_info.get("timing", {}).get("director_call")
+        if director_call:
+            latencies.append(director_call)
+        
+        if active_info.get("override_applied"):
+            overridden[i] = True
+            # Основная причина — первое слово override_reason
+            reason = active_info.get("override_reason", "unknown") or "unknown"
+            override_reasons[reason.partition(" ")[0]] += 1
     
-    initial_mode = circuit_breaker.current_mode
+    tokens_total, cost_total, domain_counts = _reduce_stats(
+        tokens, costs, called, overridden, domain_idx, len(ALL_DOMAINS)
+    )
     
-    for i, task_info in enumerate(tasks, 1):
-        print(f"\n[{i}/50] {task_info['task'][:50]}...")
-        
-        try:
-            # Создаём consilium результат
-            consilium_result = create_consilium_result(task_info, i)
-            
-            # Запускаем active director
-            result = active_director.run_active_analysis(consilium_result)
-            
-            stats["total_tasks"] += 1
-            
-            # Обновляем domain breakdown
-            for domain in task_info["domains"]:
-                stats["domain_breakdown"][domain]["tasks"] += 1
-            
-            # Анализируем результат
-            active_info = result.get("active_director", {})
-            
-            if active_info.get("active_director_used"):
-                stats["director_calls"] += 1
-                
-                for domain in task_info["domains"]:
-                    stats["domain_breakdown"][domain]["director_calls"] += 1
-                
-                # Метрики
-                metrics = active_info.get("metrics", {})
-                stats["tokens_total"] += metrics.get("total_tokens", 0)
-                stats["cost_total"] += metrics.get("total_cost", 0)
-                
-                timing = active_info.get("timing", {})
-                if timing.get("director_call"):
-                    stats["latencies"].append(timing["director_call"])
-                
-                # Override
-                if active_info.get("override_applied"):
-                    stats["overrides_applied"] += 1
-                    reason = active_info.get("override_reason", "unknown")
-                    # Извлекаем основную причину
-                    main_reason = reason.split(" ")[0] if reason else "unknown"
-                    stats["override_reasons"][main_reason] += 1
-                    
-                    for domain in task_info["domains"]:
-                        stats["domain_breakdown"][domain]["overrides"] += 1
-                    
-                    print(f"   ✅ Override: {reason[:40]}")
-                else:
-                    print(f"   📝 Review only")
-            else:
-                reason = active_info.get("reason", "unknown")
-                print(f"   ⏭️ Skipped: {reason}")
-            
-            # Проверяем mode changes
-            current_mode = circuit_breaker.current_mode
-            if current_mode != initial_mode:
-                stats["mode_changes"].append({
-                    "task_id": i,
-                    "from": initial_mode,
-                    "to": current_mode,
-                    "reason": "circuit_breaker_triggered"
-                })
-                initial_mode = current_mode
-                print(f"   ⚠️ MODE CHANGE: {stats['mode_changes'][-1]}")
-                
-        except Exception as e:
-            stats["errors"] += 1
-            print(f"   ❌ Error: {e}")
+    stats = {
+        "total_tasks": count,
+        "director_calls": int(called.sum()),
+        "overrides_applied": int(overridden.sum()),
+        "mode_changes": mode_changes,
+        "tokens_total": int(tokens_total),
+        "cost_total": float(cost_total),
+        "override_reasons": override_reasons,
+        # [tasks, director_calls, overrides] x ALL_DOMAINS
+        "domain_counts": domain_counts,
+        "errors": errors,
+        "error_types": error_types,
+        "latencies": latencies
+    }
     
     return stats
 
@@ -245,21 +488,28 @@ def generate_summary_report(stats: dict) -> dict:
     # Вычисляем средние значения
     avg_tokens = stats["tokens_total"] / max(stats["director_calls"], 1)
     avg_cost = stats["cost_total"] / max(stats["director_calls"], 1)
-    avg_latency = sum(stats["latencies"]) / max(len(stats["latencies"]), 1)
     override_rate = stats["overrides_applied"] / max(stats["director_calls"], 1)
     
+    # Среднее, минимум и максимум задержки — по numpy-массиву, без трёх проходов по списку
+    latencies = np.asarray(stats["latencies"], dtype=np.float64)
+    if latencies.size:
+        avg_latency, min_latency, max_latency = float(latencies.mean()), float(latencies.min()), float(latencies.max())
+    else:
+        avg_latency = min_latency = max_latency = 0.0
+    
     # Топ-3 причины override
-    top_reasons = sorted(stats["override_reasons"].items(), key=lambda x: -x[1])[:3]
-    
-    # Domain breakdown
-    domain_stats = {}
-    for domain, data in stats["domain_breakdown"].items():
-        domain_stats[domain] = {
-            "tasks": data["tasks"],
-            "director_calls": data["director_calls"],
-            "overrides": data["overrides"],
-            "override_rate": data["overrides"] / max(data["director_calls"], 1)
+    top_reasons = stats["override_reasons"].most_common(3)
+    
+    # Domain breakdown — одним проходом по столбцам счётчиков
+    domain_stats = {
+        domain: {
+            "tasks": tasks,
+            "director_calls": calls,
+            "overrides": overrides,
+            "override_rate": overrides / max(calls, 1)
         }
+        for domain, tasks, calls, overrides in zip(ALL_DOMAINS, *stats["domain_counts"].tolist())
+    }
     
     summary = {
         "report_date": datetime.now().isoformat(),
@@ -269,7 +519,8 @@ def generate_summary_report(stats: dict) -> dict:
             "total_tasks": stats["total_tasks"],
             "director_calls": stats["director_calls"],
             "overrides_applied": stats["overrides_applied"],
-            "errors": stats["errors"]
+            "errors": stats["errors"],
+            "error_types": dict(stats["error_types"])
         },
         
         "rates": {
@@ -292,8 +543,8 @@ def generate_summary_report(stats: dict) -> dict:
         
         "performance": {
             "avg_latency_sec": round(avg_latency, 2),
-            "min_latency_sec": round(min(stats["latencies"]) if stats["latencies"] else 0, 2),
-            "max_latency_sec": round(max(stats["latencies"]) if stats["latencies"] else 0, 2)
+            "min_latency_sec": round(min_latency, 2),
+            "max_latency_sec": round(max_latency, 2)
         },
         
         "top_override_reasons": [
@@ -314,6 +565,13 @@ def generate_summary_report(stats: dict) -> dict:
 def main():
     """Main entry point"""
     
+    # Traceback'и упавших задач — в отдельный файл, не в stdout
+    os.makedirs(os.path.dirname(ERROR_LOG_PATH), exist_ok=True)
+    handler = logging.FileHandler(ERROR_LOG_PATH, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logger.addHandler(handler)
+    logger.propagate = False
+    
     # Запускаем production run
     stats = run_production_50()
     
@@ -324,13 +582,9 @@ def main():
     # Генерируем отчёт
     summary = generate_summary_report(stats)
     
-    # Создаём директорию reports
-    os.makedirs("reports", exist_ok=True)
-    
-    # Сохраняем отчёт
+    # Сохраняем отчёт (атомарно, reports/ создаётся при необходимости)
     report_path = "reports/director_day1_summary.json"
-    with open(report_path, 'w', encoding='utf-8') as f:
-        json.dump(summary, f, indent=2, ensure_ascii=False)
+    write_json(report_path, summary)
     
     print(f"\n{'='*60}")
     print("PRODUCTION RUN COMPLETE")
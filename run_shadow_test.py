@@ -7,6 +7,7 @@ import os
 import sys
 import json
 from agent_runtime.orchestrator.consilium import get_consilium
+from agent_system.io_utils import write_json
 
 
 def test_real_tasks_with_shadow():
@@ -148,17 +149,17 @@ def test_real_tasks_with_shadow():
             print(f"Avg director time: {avg_director_time:.1f}s")
     
     # Сохраняем результаты
-    with open('shadow_test_results.json', 'w', encoding='utf-8') as f:
-        json.dump({
-            'summary': {
-                'total_tests': len(results),
-                'successful': len(successful_tests),
-                'shadow_used': shadow_used_count,
-                'total_cost': total_cost,
-                'shadow_enabled': shadow_enabled
-            },
-            'results': results
-        }, f, indent=2, ensure_ascii=False)
+    report = {
+        'summary': {
+            'total_tests': len(results),
+            'successful': len(successful_tests),
+            'shadow_used': shadow_used_count,
+            'total_cost': total_cost,
+            'shadow_enabled': shadow_enabled
+        },
+        'results': results
+    }
+    write_json('shadow_test_results.json', report)
     
     print(f"\nResults saved to shadow_test_results.json")
     
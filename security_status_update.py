@@ -2,12 +2,32 @@
 """
 Security Status Update - проверяет и обновляет статус безопасности
 """
-import json
+import asyncio
+import mmap
 import os
 import subprocess
 import requests
-import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+
+from agent_system.io_utils import write_json
+
+try:
+    import aiohttp
+
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
+# Сколько одновременных запросов шлёт проверка rate limiting
+RATE_LIMIT_PROBES = 10
+
+# Одна сессия на все проверки: keep-alive соединения переиспользуются
+# вместо нового TCP-подключения на каждый запрос
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
 
 def check_api_authentication():
     """Проверяет работу API аутентификации"""
@@ -21,7 +41,7 @@ def check_api_authentication():
     # Тест LLM API
     try:
         # Без ключа - должно вернуть 401
-        response = requests.post(
+        response = SESSION.post(
             "http://152.53.227.37:8002/v1/chat/completions",
             json={"model": "enhanced-model", "messages": [{"role": "user", "content": "test"}]},
             timeout=5,
@@ -32,7 +52,7 @@ def check_api_authentication():
             print(f"  ❌ LLM API: Expected 401, got {response.status_code}")
 
         # С ключом - должно работать
-        response = requests.post(
+        response = SESSION.post(
             "http://152.53.227.37:8002/v1/chat/completions",
             headers={"Authorization": f"Bearer {api_key}"},
             json={"model": "enhanced-model", "messages": [{"role": "user", "content": "test"}]},
@@ -49,14 +69,14 @@ def check_api_authentication():
     # Тест Tools API
     try:
         # Без ключа
-        response = requests.post("http://152.53.227.37:8003/tools/system_info", json={"info_type": "memory"}, timeout=5)
+        response = SESSION.post("http://152.53.227.37:8003/tools/system_info", json={"info_type": "memory"}, timeout=5)
         if response.status_code == 401:
             print("  ✅ Tools API: Authentication required (correct)")
         else:
             print(f"  ❌ Tools API: Expected 401, got {response.status_code}")
 
         # С ключом
-        response = requests.post(
+        response = SESSION.post(
             "http://152.53.227.37:8003/tools/system_info",
             headers={"Authorization": f"Bearer {api_key}"},
             json={"info_type": "memory"},
@@ -70,6 +90,34 @@ def check_api_authentication():
     except Exception as e:
         print(f"  ❌ Tools API: Connection error - {e}")
 
+async def _probe_burst_async(url, count):
+    """Отправляет count GET-запросов одновременно через aiohttp"""
+    timeout = aiohttp.ClientTimeout(total=2)
+
+    async def probe(session):
+        try:
+            async with session.get(url) as response:
+                return response.status
+        except Exception:
+            return None
+
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        return await asyncio.gather(*(probe(session) for _ in range(count)))
+
+def _probe_burst(url, count):
+    """HTTP-статусы count одновременных запросов (None — ошибка соединения)"""
+    if AIOHTTP_AVAILABLE:
+        return asyncio.run(_probe_burst_async(url, count))
+
+    def probe(_):
+        try:
+            return SESSION.get(url, timeout=2).status_code
+        except Exception:
+            return None
+
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        return list(executor.map(probe, range(count)))
+
 def check_rate_limiting():
     """Проверяет работу rate limiting"""
     print("\n⏱️ Checking rate limiting...")
@@ -79,21 +127,17 @@ def check_rate_limiting():
         print("❌ AGENT_API_KEY environment variable not set")
         return False
 
-    # Быстрые запросы для проверки rate limiting
+    # Пачка одновременных запросов — лимитер проверяется под настоящей нагрузкой
+    statuses = _probe_burst("http://152.53.227.37:8002/health", RATE_LIMIT_PROBES)
+
     success_count = 0
     rate_limited_count = 0
-
-    for i in range(10):
-        try:
-            response = requests.get("http://152.53.227.37:8002/health", timeout=2)
-            if response.status_code == 200:
-                success_count += 1
-            elif response.status_code == 429:
-                rate_limited_count += 1
-                print(f"  ⚠️ Rate limited on request {i+1}")
-        except Exception:
-            pass
-        time.sleep(0.1)
+    for i, status in enumerate(statuses):
+        if status == 200:
+            success_count += 1
+        elif status == 429:
+            rate_limited_count += 1
+            print(f"  ⚠️ Rate limited on request {i+1}")
 
     print(f"  📊 Results: {success_count} successful, {rate_limited_count} rate limited")
 
@@ -102,6 +146,14 @@ def check_rate_limiting():
     else:
         print("  ❌ Rate limiting: Too restrictive or not working")
 
+def _file_contains_all(path, needles):
+    """Есть ли в файле все подстроки needles (поиск по mmap, без копии в str)"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return False  # пустой файл нельзя отобразить в память
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return all(mm.find(needle) != -1 for needle in needles)
+
 def check_https_config():
     """Проверяет HTTPS конфигурацию"""
     print("\n🔒 Checking HTTPS configuration...")
@@ -122,19 +174,17 @@ def check_https_config():
 
     # Проверяем docker-compose
     if os.path.exists("docker-compose.yml"):
-        with open("docker-compose.yml", "r", encoding="utf-8") as f:
-            content = f.read()
-            if "8080:80" in content and "8443:443" in content:
-                print("  ✅ Docker ports: Configured for alternative ports")
-            else:
-                print("  ❌ Docker ports: Not configured properly")
+        if _file_contains_all("docker-compose.yml", (b"8080:80", b"8443:443")):
+            print("  ✅ Docker ports: Configured for alternative ports")
+        else:
+            print("  ❌ Docker ports: Not configured properly")
 
 def check_security_headers():
     """Проверяет security headers"""
     print("\n🛡️ Checking security headers...")
 
     try:
-        response = requests.get("http://152.53.227.37:8002/health", timeout=5)
+        response = SESSION.get("http://152.53.227.37:8002/health", timeout=5)
         headers = response.headers
 
         security_headers = {
@@ -184,8 +234,7 @@ def generate_security_report():
         ],
     }
 
-    with open("security_report.json", "w") as f:
-        json.dump(report, f, indent=2)
+    write_json("security_report.json", report)
 
     print("  ✅ Security report saved to security_report.json")
 
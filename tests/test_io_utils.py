@@ -0,0 +1,30 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from agent_system.io_utils import write_json
+
+
+class TestWriteJson(unittest.TestCase):
+    def test_writes_unicode_and_creates_parent(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "reports" / "summary.json"
+            write_json(path, {"домен": "security", "count": 3})
+
+            text = path.read_text(encoding="utf-8")
+            self.assertIn("домен", text)
+            self.assertEqual(json.loads(text), {"домен": "security", "count": 3})
+
+    def test_replaces_existing_file_without_leftover_tmp(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "summary.json"
+            path.write_text("old", encoding="utf-8")
+            write_json(str(path), [1, 2])
+
+            self.assertEqual(json.loads(path.read_text(encoding="utf-8")), [1, 2])
+            self.assertEqual([p.name for p in Path(tmpdir).iterdir()], ["summary.json"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import asyncio
+import unittest
+from unittest import mock
+
+try:
+    import numpy as np
+    import run_production_50
+except ImportError:  # numpy / openai не установлены
+    run_production_50 = None
+
+
+class _ErrorDirector:
+    """Director, у которого каждый вызов API падает (исключение ловит ActiveDirector)"""
+
+    async def run_active_analysis_async(self, consilium_result):
+        consilium_result["active_director"] = {
+            "active_director_used": False,
+            "error": "API unavailable",
+            "override_applied": False,
+        }
+        return consilium_result
+
+
+@unittest.skipIf(run_production_50 is None, "run_production_50 dependencies not installed")
+class TestDirectorErrorClassification(unittest.TestCase):
+    def test_error_result_shrinks_window_and_opens_breaker(self) -> None:
+        controllers = []
+
+        class RecordingController(run_production_50.AIMDController):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                controllers.append(self)
+
+        tasks = list(run_production_50.PRODUCTION_TASKS[:30])
+        noise = np.zeros((len(tasks), 3))
+        with mock.patch.object(run_production_50, "AIMDController", RecordingController), \
+                mock.patch("builtins.print"):
+            results = asyncio.run(
+                run_production_50._run_tasks_concurrently(_ErrorDirector(), tasks, noise, [])
+            )
+
+        controller = controllers[0]
+        self.assertEqual(controller.limit, controller.c_min)
+        self.assertTrue(controller.is_open)
+        self.assertIn(run_production_50._BREAKER_OPEN_RESULT, results)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,7 +7,7 @@ Daily Director Report Generator
 import json
 import os
 import statistics
-from collections import defaultdict
+from collections import Counter, defaultdict
 from datetime import date, datetime
 from typing import Any, Dict, List, Optional
 
@@ -61,7 +61,7 @@ def analyze_active_director_logs(entries: List[Dict]) -> Dict[str, Any]:
         "tokens_list": [],
         "costs_list": [],
         "latencies": [],
-        "override_reasons": defaultdict(int),
+        "override_reasons": Counter(),
         "domain_breakdown": defaultdict(lambda: {"calls": 0, "overrides": 0}),
         "errors": 0
     }
@@ -88,7 +88,7 @@ def analyze_active_director_logs(entries: List[Dict]) -> Dict[str, Any]:
             if active.get("override_applied"):
                 stats["overrides_applied"] += 1
                 reason = active.get("override_reason", "unknown")
-                main_reason = reason.split(" ")[0] if reason else "unknown"
+                main_reason = reason.partition(" ")[0] if reason else "unknown"
                 stats["override_reasons"][main_reason] += 1
                 
                 # Override precision: count overrides where director_confidence > consilium_confidence
@@ -229,10 +229,7 @@ def generate_markdown_report(
     p95_latency = calculate_percentile(latencies, 95)
     
     # Топ-5 причин override
-    top_reasons = sorted(
-        active_stats["override_reasons"].items(),
-        key=lambda x: -x[1]
-    )[:5]
+    top_reasons = active_stats["override_reasons"].most_common(5)
     
     # Domain breakdown
     domains = dict(active_stats["domain_breakdown"])
@@ -53,6 +53,7 @@ def main():
         dataset_text_field="text",
         max_length=512,
         packing=False,
+        dataset_num_proc=os.cpu_count(),  # parallel datasets.map for tokenization
         num_train_epochs=1,
         per_device_train_batch_size=1,
         gradient_accumulation_steps=8,